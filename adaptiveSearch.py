@@ -0,0 +1,184 @@
+# Adaptive relaxation times search
+#
+# Coarse to fine mantissas: the grid search first sweeps the mantissas with a
+# coarse step, then only the mantissas around the best candidates are added,
+# at successively finer steps. Every exponent window of an added mantissa is
+# evaluated, since the cost of a mantissa is building its Gram index, so the
+# candidates always form the grid of the mantissas evaluated so far and the
+# usual selection applies. Each step is scored by the residual of the
+# candidate the selection picks on its grid, the one that would be returned,
+# and the pick of the best scored step is returned once the score stops
+# improving. A finer grid may pick a worse fitting candidate, since the
+# selection does not rank by residual, so the last pick is not always kept.
+
+import numpy as np
+
+import prony as pr
+import searchStats as sst
+
+# mantissa steps, from the coarse sweep to the finest refinement
+STEPS = [1, 0.5, 0.25, 0.1]
+
+# number of best candidates refined at each step
+TOP = 3
+
+# finer steps without improvement before the refinement stops
+PATIENCE = 2
+
+'''
+ Splits the candidates of a block of relaxation times table rows into the
+ candidates of each row
+
+ cand - a Candidates collection of the block, in the grid search order
+ num - number of terms in Prony series
+
+ Returns - a list of Candidates collections, one per table row
+'''
+def splitRows(cand, num):
+    nwin = pr.windowCount(num)
+    fields = [np.reshape(v, (nwin, -1) + np.shape(v)[1:]) for v in cand]
+
+    return [pr.Candidates(*[f[:, j] for f in fields]) for j in range(fields[0].shape[1])]
+
+'''
+ Gets the mantissas of a finer step around the mantissas of the best candidates
+
+ mantissas - mantissas to refine
+ step - finer mantissa step
+ previous - mantissa step of the previous sweep
+ evaluated - mantissas already evaluated
+
+ Returns - a sorted numpy float array with the new mantissas
+'''
+def refineMantissas(mantissas, step, previous, evaluated):
+    lattice = np.round(np.arange(1.0, 10.0, step), 10)
+    near = np.zeros(len(lattice), dtype=bool)
+    for m in mantissas:
+        near |= np.abs(lattice - m) < previous - 1e-9
+
+    return np.setdiff1d(lattice[near], np.round(list(evaluated), 10))
+
+'''
+ Gets the mantissas of the candidates with the smallest residuals, among the
+ accepted candidates, or among every nonsingular candidate while no candidate
+ is accepted
+
+ rss - estimated residual sum of squares of each candidate
+ (prony.candidateResiduals)
+ accepted - boolean array of the accepted candidates
+ mantissas - mantissa of each candidate
+ top - number of distinct mantissas
+
+ Returns - a list of mantissas
+'''
+def bestMantissas(rss, accepted, mantissas, top):
+    pool = np.flatnonzero(accepted) if np.any(accepted) else np.flatnonzero(np.isfinite(rss))
+    best = []
+    for i in pool[np.argsort(rss[pool], kind='stable')]:
+        if mantissas[i] not in best:
+            best.append(mantissas[i])
+        if len(best) == top:
+            break
+
+    return best
+
+'''
+ Calculates the relaxation times by the adaptive search: the mantissas are
+ swept with the first step, then refined with each finer step around the
+ selected candidate and the accepted candidates of smallest residual, until
+ the residual of the selected candidate does not improve for patience steps
+
+ time - time values array
+ tension - tension values array
+ kz - deformation ratio
+ num - number of terms in Prony series
+ eInf - the given equilibrium module, or None to determinate it
+ workers, threads - as in prony.getRelaxationTimes
+ stats - optional SearchStats
+ progress - optional function called as progress(steps done, steps, best)
+ after each step, best being the result of the best scored step so far
+ cancel - optional threading.Event, prony.SearchCancelled is raised once it is set
+ weights - optional sample weights array (prony.logTimeBins)
+ steps - mantissa steps, coarse to fine
+ top - number of best candidates refined at each step, besides the selected one
+ patience - number of finer steps without improvement before stopping
+ archive - optional .npy file receiving the candidates of every mantissa
+ evaluated, in increasing order (prony.writeArchive)
+
+ Returns - a prony.Relaxation collection, the selected candidate of the step
+ of smallest residual
+'''
+def getRelaxationTimesAdaptive(time, tension, kz, num, eInf=None, workers=1, threads=None, stats=None,
+                               progress=None, cancel=None, weights=None, steps=STEPS, top=TOP, patience=PATIENCE,
+                               archive=None):
+    tt = np.asarray(time, dtype=float)
+    ss = np.asarray(tension, dtype=float)
+    givenEinf = eInf is not None
+    nwin = pr.windowCount(num)
+
+    # Candidates of each mantissa evaluated
+    parts = {}
+    mantissas = np.round(np.arange(1.0, 10.0, steps[0]), 10)
+    score = np.inf
+    stale = 0
+    result = None
+    # mantissas refined at the next step
+    best = []
+
+    with sst.run(stats):
+        for level, step in enumerate(steps):
+            if level > 0:
+                mantissas = refineMantissas(best, step, steps[level-1], parts)
+                if len(mantissas) == 0:
+                    break
+
+            cand = pr.searchCandidates(tt, ss, pr.mantissaTable(mantissas), kz, num, eInf, workers, threads, stats,
+                                       None, cancel, weights)
+            parts.update(zip(mantissas, splitRows(cand, num)))
+
+            # the grid of the mantissas evaluated so far
+            evaluated = sorted(parts)
+            cand = pr.mergeCandidates([parts[m] for m in evaluated], num)
+            with sst.stage(stats, 'selection'):
+                rss = pr.candidateResiduals(cand, tt, ss, kz, eInf, weights)
+                accepted = pr.acceptedCandidates(cand, givenEinf)
+                try:
+                    k = pr.selectAccepted(cand, accepted, givenEinf)
+                except ValueError:
+                    k = None
+                # the selected candidate is refined too
+                candMantissas = np.tile(evaluated, nwin)
+                best = bestMantissas(rss, accepted, candMantissas, top)
+                if k is not None and candMantissas[k] not in best:
+                    best.append(candMantissas[k])
+
+                # score: the residual of the selected candidate
+                current = np.inf
+                picked = None
+                if k is not None:
+                    picked = pr.relaxationResult(cand, k, kz, num, eInf)
+                    current = pr.resultResidual(tt, ss, picked, num, weights)
+                if current < score:
+                    score, result, stale = current, picked, 0
+                else:
+                    stale += 1
+
+            if progress is not None:
+                progress(level+1, len(steps), result)
+
+            if stale >= patience:
+                break
+
+        if stats is not None:
+            pr.acceptedCandidates(cand, givenEinf, stats)
+        if archive is not None:
+            pr.writeArchive(archive, cand, num, givenEinf)
+
+    if result is None:
+        raise ValueError('no relaxation times satisfy the selection criteria')
+
+    if progress is not None and level+1 < len(steps):
+        # stopped before the finest step
+        progress(len(steps), len(steps), result)
+
+    return result
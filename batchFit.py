@@ -0,0 +1,268 @@
+# Headless batch fitting of creep tests
+#
+# Fits the Prony series of many creep test csv files concurrently and writes
+# one consolidated csv or json file with the constants and the run timings of
+# each file. A file that fails is reported and the batch goes on.
+#
+#   python batchFit.py creep-test/ --rate 0.5 --terms 9 --step 1 --output results.csv
+#   python batchFit.py "tests/*.csv" --rate 0.5 --einf 1000 --output results.json
+#   python batchFit.py long-tests/ --rate 0.5 --bins 300 --output results.csv
+#   python batchFit.py creep-test/ --rate 0.5 --search continuous --output results.csv
+#   python batchFit.py creep-test/ --rate 0.5 --einf 1000 --strict --output results.csv
+#
+# The results are cached on disk (fitCache), so running the same files with
+# the same settings again only reads them; --no-cache searches anyway.
+# --archive-dir keeps every candidate of each search in a .npy file named
+# after the input file and a hash of its path, so files of the same name in
+# different directories do not share it (prony.readArchive opens it without
+# loading it).
+# --strict also rejects the ill conditioned candidate systems
+# (system.STRICT_RCOND), which may leave a test without a fit.
+
+import os
+import sys
+import csv
+import glob
+import json
+import hashlib
+import time
+import argparse
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import prony as pr
+import system as st
+import pronySerie as ps
+import parallelSearch as psr
+import fitCache as fc
+
+STEPS = [10, 1, 0.5, 0.25, 0.1]
+
+'''
+ Expands the input arguments into csv file paths: a directory gives its csv
+ files, anything else is taken as a glob pattern
+
+ inputs - directories, files or glob patterns
+
+ Returns - the sorted list of distinct file paths
+'''
+def expandInputs(inputs):
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            files.update(glob.glob(os.path.join(item, '*.csv')))
+        else:
+            files.update(p for p in glob.glob(item) if os.path.isfile(p))
+
+    return sorted(files)
+
+'''
+ Gets the candidates archive of an input file: its name, a hash of its
+ absolute path and .npy, in the archive directory
+
+ archiveDir - candidates archive directory
+ fileName - input file path
+
+ Returns - the archive file path
+'''
+def archivePath(archiveDir, fileName):
+    name = os.path.splitext(os.path.basename(fileName))[0]
+    digest = hashlib.sha1(os.path.abspath(fileName).encode()).hexdigest()[:8]
+
+    return os.path.join(archiveDir, '{}-{}.npy'.format(name, digest))
+
+'''
+ Fits the Prony series of a creep test file
+
+ task - a tuple containing: file path, rate, terms, step, E_inf (None to determinate it),
+ the number of log-time bins (None to fit every sample), the search mode,
+ the cache directory (None for no cache), the candidates archive
+ directory (None for no archive) and the singular floor (system.RCOND)
+
+ Returns - a dictionary with the file, the status and the constants or the error
+'''
+def fitFile(task):
+    fileName, rate, terms, step, eInf, bins, search, cacheDir, archiveDir, rcond = task
+    st.RCOND = rcond
+    record = {'file': fileName, 'status': 'ok', 'error': '',
+              'terms': terms, 'rate': rate, 'step': step, 'given_einf': eInf is not None, 'bins': bins,
+              'search': search}
+    start = time.perf_counter()
+    try:
+        serie = ps.PronySerie()
+        serie.setTestOutput(pr.readCSV(fileName), bins)
+        read = time.perf_counter()
+
+        serie.setTerms(terms)
+        serie.setRate(rate)
+        serie.setStep(step)
+        serie.setSearch(search)
+        if cacheDir is not None:
+            serie.setCache(fc.FitCache(cacheDir))
+        if archiveDir is not None:
+            serie.setArchive(archivePath(archiveDir, fileName))
+        serie.setGivenEinfSerieType(eInf is not None)
+        if eInf is not None:
+            serie.setGivenEinf(eInf)
+        serie.runRelaxation()
+        fit = time.perf_counter()
+
+        record['samples'] = len(serie.time)
+        record['cached'] = serie.cached
+        record['equilibrium_module'] = float(serie.results.equilibrium_module)
+        record['relaxation_times'] = [float(p) for p in serie.results.relaxation_times]
+        record['modules'] = [float(e) for e in serie.results.modules]
+        record['r_squared'] = serie.results.r_squared
+        record['variation_coefficient'] = serie.results.variation_coefficient
+        record['read_seconds'] = read - start
+        record['fit_seconds'] = fit - read
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = '{}: {}'.format(type(e).__name__, e)
+        record['traceback'] = traceback.format_exc()
+    record['total_seconds'] = time.perf_counter() - start
+
+    return record
+
+'''
+ Fits the files over a process pool, in input order
+
+ files - list of file paths
+ rate, terms, step, eInf, bins, search - fit parameters
+ cacheDir - results cache directory, None for no cache
+ archiveDir - candidates archive directory, None for no archive
+ rcond - singular floor of the candidate systems (system.RCOND)
+ workers - number of worker processes
+ threads - BLAS threads of each worker
+
+ Returns - the list of records, one per file
+'''
+def fitFiles(files, rate, terms, step, eInf, bins, search, cacheDir, archiveDir, rcond, workers, threads):
+    tasks = [(f, rate, terms, step, eInf, bins, search, cacheDir, archiveDir, rcond) for f in files]
+    if workers == 1:
+        return [report(fitFile(t)) for t in tasks]
+
+    ctx = mp.get_context('spawn')
+    with psr.blasThreads(threads):
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+    records = []
+    with pool:
+        futures = [pool.submit(fitFile, t) for t in tasks]
+        for task, future in zip(tasks, futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                # the worker itself died, e.g. out of memory
+                record = {'file': task[0], 'status': 'failed', 'error': '{}: {}'.format(type(e).__name__, e)}
+            records.append(report(record))
+
+    return records
+
+'''
+ Prints the outcome of a file on the standard error
+
+ record - fit record
+
+ Returns - the record
+'''
+def report(record):
+    if record['status'] == 'ok':
+        print('ok      {} ({:.3f} s{})'.format(record['file'], record['total_seconds'],
+                                          ', cached' if record.get('cached') else ''), file=sys.stderr)
+    else:
+        print('failed  {}: {}'.format(record['file'], record['error']), file=sys.stderr)
+
+    return record
+
+'''
+ Writes the records as json
+
+ fileName - output file
+ records - fit records
+'''
+def writeJSON(fileName, records):
+    with open(fileName, 'w') as f:
+        json.dump(records, f, indent=1)
+
+'''
+ Writes the records as csv, one row per file with the relaxation times
+ p_1, ... , p_n and the modules E_1, ... , E_n
+
+ fileName - output file
+ records - fit records
+ terms - number of terms in Prony series
+'''
+def writeCSV(fileName, records, terms):
+    header = (['file', 'status', 'error', 'samples', 'equilibrium_module'] +
+              ['p_{}'.format(i+1) for i in range(terms)] +
+              ['E_{}'.format(i+1) for i in range(terms)] +
+              ['r_squared', 'variation_coefficient', 'read_seconds', 'fit_seconds', 'total_seconds', 'cached'])
+
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for r in records:
+            times = r.get('relaxation_times', [''] * terms)
+            modules = r.get('modules', [''] * terms)
+            writer.writerow([r['file'], r['status'], r['error'], r.get('samples', ''),
+                             r.get('equilibrium_module', '')] +
+                            list(times) + list(modules) +
+                            [r.get('r_squared', ''), r.get('variation_coefficient', ''), r.get('read_seconds', ''), r.get('fit_seconds', ''), r.get('total_seconds', ''),
+                             r.get('cached', '')])
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description='Fits the Prony series of many creep tests')
+    parser.add_argument('inputs', nargs='+', help='directories, csv files or glob patterns')
+    parser.add_argument('--rate', type=float, required=True, help='deformation rate')
+    parser.add_argument('--terms', type=int, default=9, choices=range(7, 12), help='number of terms (default 9)')
+    parser.add_argument('--step', type=float, default=1, choices=STEPS, help='relaxation times step (default 1)')
+    parser.add_argument('--einf', type=float, help='given equilibrium module E_inf')
+    parser.add_argument('--bins', type=int, help='fit this number of log-spaced time bins instead of every sample')
+    parser.add_argument('--search', default='grid', choices=['grid', 'continuous', 'adaptive'],
+                        help='relaxation times search: grid with the step, continuous optimization '
+                             'or adaptive coarse to fine grid (default grid)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--threads', type=int, help='BLAS threads of each worker (default: cores // workers)')
+    parser.add_argument('--output', required=True, help='consolidated .csv or .json file')
+    parser.add_argument('--cache-dir', help='results cache directory (default $VISCOMODULE_CACHE or {})'.format(fc.DIRECTORY))
+    parser.add_argument('--no-cache', action='store_true', help='search every file, without the results cache')
+    parser.add_argument('--archive-dir', help='write every candidate of each search to a .npy file in this directory')
+    parser.add_argument('--strict', action='store_true',
+                        help='reject the ill conditioned candidate systems too (rcond below {:g})'.format(st.STRICT_RCOND))
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArguments(argv)
+
+    files = expandInputs(args.inputs)
+    if len(files) == 0:
+        print('no csv file found', file=sys.stderr)
+        return 2
+
+    workers = max(1, min(args.workers, len(files)))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+
+    start = time.perf_counter()
+    cacheDir = None if args.no_cache else fc.FitCache(args.cache_dir).directory
+    if args.archive_dir is not None:
+        os.makedirs(args.archive_dir, exist_ok=True)
+    rcond = st.STRICT_RCOND if args.strict else st.RCOND
+    records = fitFiles(files, args.rate, args.terms, args.step, args.einf, args.bins, args.search, cacheDir,
+                       args.archive_dir, rcond, workers, threads)
+    elapsed = time.perf_counter() - start
+
+    if args.output.lower().endswith('.json'):
+        writeJSON(args.output, records)
+    else:
+        writeCSV(args.output, records, args.terms)
+
+    failed = sum(r['status'] != 'ok' for r in records)
+    print('{} file(s), {} failed, {:.3f} s'.format(len(records), failed, elapsed), file=sys.stderr)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,475 @@
+# Benchmark suite with a performance-regression gate
+#
+# Times the relaxation search (getRelaxationTimes, getRelaxationTimesEinf),
+# the Prony series and tension evaluation and the csv ingest on the files
+# shipped with the project and on synthetic creep curves generated from the
+# literature series.
+#
+#   python benchmark.py run --output baseline.json
+#   python benchmark.py compare baseline.json --threshold 0.25
+#   python benchmark.py imports --budget 0.25
+#   python benchmark.py decimation --series Park1999 --size 1000000 --bins 100 300 1000
+#
+# compare runs the cases of the baseline again and exits with status 1 when a
+# case is slower than the baseline by more than the threshold. imports exits
+# with status 1 when importing the numerical core takes longer than the budget
+# or loads one of the heavy modules, which must stay lazy; the time includes a
+# first small fit, so the modules loaded on the fit path are counted too. decimation compares
+# the fit of every sample with the fit of log-time bins, to choose the number
+# of bins of long tests; it exits with status 1 when a fit fails.
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+import prony as pr
+import continuousSearch as cs
+import adaptiveSearch as ads
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CREEP_TEST = os.path.join(ROOT, 'creep-test', 'creep-test.csv')
+LITERATURE = sorted(glob.glob(os.path.join(ROOT, 'relaxation-modulus', '*.csv')))
+
+# the choices of the GUI
+TERMS = [7, 8, 9, 10, 11]
+STEPS = [10, 1, 0.5, 0.25, 0.1]
+SIZES = [1000, 10000, 100000, 1000000, 10000000]
+
+# synthetic creep test: duration (s), deformation rate and E_inf
+# relative to the smallest module of the series
+DURATION = 1000.0
+RATE = 1.0
+EINF_RATIO = 0.5
+
+# given E_inf of the real creep test fits
+CREEP_EINF = 1000.0
+CREEP_RATE = 0.5
+
+# E_inf of the sweep cases relative to the given E_inf
+EINF_SWEEP = [0.5, 0.75, 1.0, 1.25, 1.5]
+
+# deformation rates of the rate sweep cases relative to the test rate
+RATE_SWEEP = [0.5, 1.0, 2.0, 3.0, 4.0]
+
+# decades spanned by the crowded starting relaxation times of the continuous
+# cases, whose optimizer steps cross singular systems
+CROWDED = (0.0, 2.0)
+
+# numerical core modules, the heavy modules they must not import eagerly,
+# nor load on a first fit, and the time budget (s) of the core import and a
+# first small fit, numpy included
+CORE_MODULES = ['system', 'prony', 'pronySerie', 'searchStats', 'continuousSearch', 'adaptiveSearch']
+HEAVY_MODULES = ['scipy', 'matplotlib', 'PyQt5']
+IMPORT_BUDGET = 0.25
+
+# numbers of log-time bins compared by default
+BINS = [100, 300, 1000, 3000]
+
+'''
+ Measures the best wall time of a function over some repetitions
+
+ fn - function without arguments
+ repeat - number of repetitions
+
+ Returns - the smallest wall time in seconds
+'''
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            fn()
+        except ValueError:
+            # no candidate accepted: the search ran anyway
+            pass
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+'''
+ Measures the import of the numerical core and a first small fit, with and
+ without E_inf, in a fresh interpreter, as a worker process or a CLI run
+ pays them
+
+ Returns - a tuple containing: the import and fit time in seconds and the
+ heavy modules loaded
+'''
+def importCore():
+    code = ('import sys, time\n'
+            't = time.perf_counter()\n'
+            'import {}\n'
+            'import numpy as np\n'
+            'tt = np.linspace(1.0, 1000.0, 1000)\n'
+            'ss = tt + 100.0*(1.0 - np.exp(-tt/10.0))\n'
+            'for eInf in (None, 1.0):\n'
+            '    try:\n'
+            '        prony.getRelaxationTimesTerms(tt, ss, 1.0, [3], 10, eInf)\n'
+            '    except ValueError:\n'
+            '        pass\n'
+            'print(time.perf_counter() - t)\n'
+            'print(",".join(m for m in {!r} if m in sys.modules))\n').format(', '.join(CORE_MODULES), HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout.splitlines()
+    heavy = out[1].split(',') if len(out) > 1 and out[1] else []
+
+    return (float(out[0]), heavy)
+
+'''
+ Reads a literature Prony series
+
+ fileName - csv with relaxation times and modules
+
+ Returns - a tuple containing: relaxation times, modules and E_inf
+'''
+def literatureSerie(fileName):
+    pp, ee = pr.readCSV(fileName)
+
+    return (pp, ee, EINF_RATIO*np.min(ee))
+
+'''
+ Generates a synthetic creep curve from a literature Prony series
+
+ fileName - csv with relaxation times and modules
+ size - number of samples
+
+ Returns - a tuple containing the time and tension arrays
+'''
+def syntheticCreep(fileName, size):
+    pp, ee, eInf = literatureSerie(fileName)
+    time = np.linspace(DURATION/size, DURATION, size)
+
+    return (time, pr.tension(time, RATE, eInf, ee, pp, len(pp)))
+
+'''
+ Builds the benchmark cases
+
+ args - parsed command line arguments
+
+ Returns - a list of (name, function) tuples
+'''
+def buildCases(args):
+    cases = [('import/core', lambda: importCore())]
+    series = [f for f in LITERATURE if not args.series or
+              os.path.splitext(os.path.basename(f))[0] in args.series]
+
+    # real creep test
+    if not args.synthetic_only:
+        creep = pr.readCSV(CREEP_TEST)
+        cases.append(('ingest/creep-test', lambda: pr.readCSV(CREEP_TEST)))
+        for num in args.terms:
+            for step in args.steps:
+                cases.append(('fit/creep-test/n{}/step{:g}'.format(num, step),
+                              lambda num=num, step=step:
+                              pr.getRelaxationTimes(creep[0], creep[1], CREEP_RATE, num, step)))
+                cases.append(('fitEinf/creep-test/n{}/step{:g}'.format(num, step),
+                              lambda num=num, step=step:
+                              pr.getRelaxationTimesEinf(creep[0], creep[1], CREEP_EINF, CREEP_RATE, num, step)))
+                cases.append(('fitEinfSweep/creep-test/n{}/step{:g}'.format(num, step),
+                              lambda num=num, step=step:
+                              pr.getRelaxationTimesEinfSweep(creep[0], creep[1], [CREEP_EINF*r for r in EINF_SWEEP],
+                                                             CREEP_RATE, num, step)))
+                cases.append(('fitRates/creep-test/n{}/step{:g}'.format(num, step),
+                              lambda num=num, step=step:
+                              pr.getRelaxationTimesRates(creep[0], creep[1], [CREEP_RATE*r for r in RATE_SWEEP],
+                                                         num, step)))
+            cases.append(('fitContinuous/creep-test/n{}'.format(num),
+                          lambda num=num: cs.getRelaxationTimesContinuous(creep[0], creep[1], CREEP_RATE, num)))
+            cases.append(('fitContinuous/creep-test/n{}/crowded'.format(num),
+                          lambda num=num: cs.optimizeRelaxationTimes(creep[0], creep[1], CREEP_RATE,
+                                                                     np.logspace(*CROWDED, num), CREEP_EINF)))
+            cases.append(('fitAdaptive/creep-test/n{}'.format(num),
+                          lambda num=num: ads.getRelaxationTimesAdaptive(creep[0], creep[1], CREEP_RATE, num)))
+        for step in args.steps:
+            cases.append(('fitTerms/creep-test/step{:g}'.format(step),
+                          lambda step=step: pr.getRelaxationTimesTerms(creep[0], creep[1], CREEP_RATE, args.terms, step)))
+
+    # synthetic creep curves from the literature series, only the curve of
+    # the running cases is kept in memory
+    current = {}
+    for fileName in series:
+        name = os.path.splitext(os.path.basename(fileName))[0]
+        pp, ee, eInf = literatureSerie(fileName)
+        for size in args.sizes:
+            tag = '{}/{:.0e}'.format(name, size)
+
+            def data(fileName=fileName, size=size):
+                # generated on first use and kept for the cases of this size
+                if current.get('key') != (fileName, size):
+                    current.clear()
+                    current['data'] = syntheticCreep(fileName, size)
+                    current['key'] = (fileName, size)
+                return current['data']
+
+            cases.append(('tension/' + tag,
+                          lambda data=data, ee=ee, pp=pp, eInf=eInf:
+                          pr.tension(data()[0], RATE, eInf, ee, pp, len(pp))))
+            cases.append(('prony/' + tag,
+                          lambda data=data, ee=ee, pp=pp, eInf=eInf:
+                          pr.prony(data()[0], eInf, ee, pp, len(pp))))
+            if size <= args.max_ingest:
+                cases.append(('ingest/' + tag, lambda data=data, tag=tag: ingest(data(), args.workdir, tag)))
+                for ext in ['.csv', '.npy']:
+                    cases.append(('export{}/'.format(ext) + tag,
+                                  lambda data=data, tag=tag, ext=ext: export(data(), args.workdir, tag, ext)))
+            for num in args.terms:
+                for step in args.steps:
+                    cases.append(('fit/{}/n{}/step{:g}'.format(tag, num, step),
+                                  lambda data=data, num=num, step=step:
+                                  pr.getRelaxationTimes(data()[0], data()[1], RATE, num, step)))
+                    cases.append(('fitEinf/{}/n{}/step{:g}'.format(tag, num, step),
+                                  lambda data=data, num=num, step=step, eInf=eInf:
+                                  pr.getRelaxationTimesEinf(data()[0], data()[1], eInf, RATE, num, step)))
+                    cases.append(('fitEinfSweep/{}/n{}/step{:g}'.format(tag, num, step),
+                                  lambda data=data, num=num, step=step, eInf=eInf:
+                                  pr.getRelaxationTimesEinfSweep(data()[0], data()[1], [eInf*r for r in EINF_SWEEP],
+                                                                 RATE, num, step)))
+                    cases.append(('fitRates/{}/n{}/step{:g}'.format(tag, num, step),
+                                  lambda data=data, num=num, step=step:
+                                  pr.getRelaxationTimesRates(data()[0], data()[1], [RATE*r for r in RATE_SWEEP],
+                                                             num, step)))
+                cases.append(('fitContinuous/{}/n{}'.format(tag, num),
+                              lambda data=data, num=num: cs.getRelaxationTimesContinuous(data()[0], data()[1], RATE, num)))
+                cases.append(('fitContinuous/{}/n{}/crowded'.format(tag, num),
+                              lambda data=data, num=num, eInf=eInf:
+                              cs.optimizeRelaxationTimes(data()[0], data()[1], RATE, np.logspace(*CROWDED, num), eInf)))
+                cases.append(('fitAdaptive/{}/n{}'.format(tag, num),
+                              lambda data=data, num=num: ads.getRelaxationTimesAdaptive(data()[0], data()[1], RATE, num)))
+            for step in args.steps:
+                cases.append(('fitTerms/{}/step{:g}'.format(tag, step),
+                              lambda data=data, step=step:
+                              pr.getRelaxationTimesTerms(data()[0], data()[1], RATE, args.terms, step)))
+
+    return cases
+
+'''
+ Reads a synthetic creep curve written as csv, the file is written once
+
+ data - time and tension arrays
+ workdir - directory of the csv files
+ tag - case tag used as file name
+'''
+def ingest(data, workdir, tag):
+    fileName = os.path.join(workdir, tag.replace('/', '_') + '.csv')
+    if not os.path.exists(fileName):
+        pr.writeCSV(fileName, data)
+
+    return pr.readCSV(fileName)
+
+'''
+ Writes a synthetic creep curve as the simulation export of the GUI
+
+ data - time and tension arrays
+ workdir - directory of the output files
+ tag - case tag used as file name
+ ext - file extension, .csv, .npy or .npz (prony.writeColumns)
+'''
+def export(data, workdir, tag, ext):
+    fileName = os.path.join(workdir, 'export_' + tag.replace('/', '_') + ext)
+
+    return pr.writeColumns(fileName, ['time', 'tension'], data)
+
+'''
+ Runs the benchmark cases
+
+ cases - list of (name, function) tuples
+ repeat - number of repetitions of each case
+
+ Returns - a dictionary with the wall time of each case
+'''
+def runCases(cases, repeat):
+    results = {}
+    for name, fn in cases:
+        seconds = timeit(fn, repeat)
+        results[name] = seconds
+        print('{:<50s} {:12.6f} s'.format(name, seconds), flush=True)
+
+    return results
+
+'''
+ Describes the machine and the library versions of a run
+'''
+def environment():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+'''
+ Compares the wall times of a run with the baseline
+
+ baseline - baseline wall times by case
+ current - current wall times by case
+ threshold - allowed relative slowdown
+
+ Returns - the list of (name, baseline, current) of the slower cases
+'''
+def compareResults(baseline, current, threshold):
+    slower = []
+    for name, seconds in sorted(current.items()):
+        if name not in baseline:
+            continue
+        ratio = seconds/baseline[name] if baseline[name] > 0 else 1.0
+        flag = 'SLOWER' if ratio > 1 + threshold else ''
+        print('{:<50s} {:12.6f} s {:12.6f} s {:7.2f}x {}'.format(name, baseline[name], seconds, ratio, flag))
+        if flag:
+            slower.append((name, baseline[name], seconds))
+
+    return slower
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description='Viscomodule benchmark suite')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='run the cases and write a baseline file')
+    run.add_argument('--output', default='benchmark-baseline.json', help='baseline file')
+
+    compare = sub.add_parser('compare', help='run the cases of a baseline and compare')
+    compare.add_argument('baseline', help='baseline file')
+    compare.add_argument('--current', help='compare this results file instead of running the cases')
+    compare.add_argument('--threshold', type=float, default=0.25,
+                         help='allowed relative slowdown of a case (default 0.25)')
+    compare.add_argument('--output', help='also write the current results to this file')
+
+    imports = sub.add_parser('imports', help='check the import time of the numerical core and a first fit')
+    imports.add_argument('--budget', type=float, default=IMPORT_BUDGET,
+                         help='import time budget in seconds (default {})'.format(IMPORT_BUDGET))
+    imports.add_argument('--repeat', type=int, default=5, help='repetitions, the best is kept')
+
+    decimation = sub.add_parser('decimation', help='compare the fit of log-time bins with the full fit')
+    decimation.add_argument('--input', default=CREEP_TEST, help='creep test csv file (default the project creep test)')
+    decimation.add_argument('--series', help='use the synthetic creep curve of this literature series instead')
+    decimation.add_argument('--size', type=int, default=1000000, help='samples of the synthetic curve')
+    decimation.add_argument('--rate', type=float, help='deformation rate (default that of the input)')
+    decimation.add_argument('--einf', type=float,
+                            help='given equilibrium module E_inf (default {:g} for the project creep test, '
+                                 'else determinated)'.format(CREEP_EINF))
+    decimation.add_argument('--free-einf', action='store_true', help='determinate E_inf of the project creep test too')
+    decimation.add_argument('--terms', type=int, default=9)
+    decimation.add_argument('--step', type=float, default=1)
+    decimation.add_argument('--bins', type=int, nargs='+', default=BINS)
+
+    for p in (run, compare):
+        p.add_argument('--terms', type=int, nargs='+', default=TERMS)
+        p.add_argument('--steps', type=float, nargs='+', default=STEPS)
+        p.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+        p.add_argument('--series', nargs='+', help='literature series names, e.g. Park1999')
+        p.add_argument('--max-ingest', type=int, default=1000000,
+                       help='largest synthetic csv ingest size')
+        p.add_argument('--synthetic-only', action='store_true', help='skip the real creep test cases')
+        p.add_argument('--repeat', type=int, default=3, help='repetitions of each case, the best is kept')
+        p.add_argument('--filter', help='only run cases whose name contains this text')
+
+    return parser.parse_args(argv)
+
+def writeResults(fileName, results):
+    with open(fileName, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=1, sort_keys=True)
+
+'''
+ Compares the fit of log-time bins with the fit of every sample, printing
+ the speedup and the relative errors of each number of bins, or the error of
+ a failed fit
+
+ args - parsed command line arguments
+
+ Returns - the exit status
+'''
+def checkDecimation(args):
+    if args.series:
+        fileName = os.path.join(ROOT, 'relaxation-modulus', args.series + '.csv')
+        time, tension = syntheticCreep(fileName, args.size)
+        rate = RATE if args.rate is None else args.rate
+        known = None
+    else:
+        time, tension = pr.readCSV(args.input)
+        rate = CREEP_RATE if args.rate is None else args.rate
+        known = CREEP_EINF if os.path.abspath(args.input) == CREEP_TEST else None
+    eInf = None if args.free_einf else known if args.einf is None else args.einf
+
+    print('{:>6s} {:>10s} {:>10s} {:>8s} {:>6s} {:>10s} {:>10s} {:>10s}'.format(
+          'bins', 'full (s)', 'bins (s)', 'speedup', 'same p', 'E_inf', 'E_i', 'tension'))
+    failed = 0
+    for bins in args.bins:
+        try:
+            d = pr.compareDecimation(time, tension, rate, args.terms, args.step, bins, eInf)
+        except ValueError as e:
+            print('{:6d} failed: {}'.format(bins, e))
+            failed += 1
+            continue
+        print('{:6d} {:10.4f} {:10.4f} {:7.1f}x {:>6s} {:10.2e} {:10.2e} {:10.2e}'.format(
+              d.bins, d.full_seconds, d.decimated_seconds, d.speedup, 'yes' if d.same_relaxation_times else 'no',
+              d.equilibrium_module_error, d.modules_error, d.tension_error))
+
+    if failed:
+        print('{} of {} comparison(s) failed'.format(failed, len(args.bins)))
+        return 1
+
+    return 0
+
+'''
+ Checks the import time of the numerical core against a budget
+
+ budget - import time budget in seconds
+ repeat - number of repetitions, the best is kept
+
+ Returns - the exit status
+'''
+def checkImports(budget, repeat):
+    seconds, heavy = min(importCore() for _ in range(repeat))
+    print('import {} and a first fit: {:.3f} s (budget {:.3f} s)'.format(', '.join(CORE_MODULES), seconds, budget))
+    if heavy:
+        print('heavy modules loaded by the import or the first fit: ' + ', '.join(heavy))
+
+    return 1 if seconds > budget or heavy else 0
+
+def main(argv=None):
+    args = parseArguments(argv)
+
+    if args.command == 'imports':
+        return checkImports(args.budget, args.repeat)
+
+    if args.command == 'decimation':
+        return checkDecimation(args)
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    if args.command == 'compare' and args.current:
+        with open(args.current) as f:
+            current = json.load(f)['results']
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            args.workdir = workdir
+            cases = buildCases(args)
+            if args.filter:
+                cases = [c for c in cases if args.filter in c[0]]
+            if args.command == 'compare':
+                cases = [c for c in cases if c[0] in baseline]
+            current = runCases(cases, args.repeat)
+
+    if args.command == 'run':
+        writeResults(args.output, current)
+        return 0
+
+    if args.output:
+        writeResults(args.output, current)
+
+    slower = compareResults(baseline, current, args.threshold)
+    if slower:
+        print('{} case(s) slower than the baseline by more than {:.0%}'.format(len(slower), args.threshold))
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
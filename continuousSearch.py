@@ -0,0 +1,196 @@
+# Continuous relaxation times search
+#
+# Variable projection: the log-relaxation times are optimized continuously,
+# instead of being taken from the lattice of the relaxation times table. For
+# each relaxation times array the modules are eliminated by the least squares
+# system of the grid search (system.matrixA, system.vectorB), so the optimizer
+# only sees the num relaxation times. The optimization starts from the lattice
+# point with the smallest residual of a coarse grid search, or of a finer one
+# when every candidate of the coarse grid is singular.
+
+import numpy as np
+
+import prony as pr
+import system as st
+import searchStats as sst
+
+# mantissa steps of the grid search giving the starting point, a finer one
+# only searched when every candidate of the previous one is singular
+START_STEPS = [10, 1, 0.1]
+
+# bounds of log10(p): a decade beyond the relaxation times table
+LOG_BOUNDS = (-7.0, 12.0)
+
+# default limit of the optimizer system solves
+MAX_SOLVES = 200
+
+'''
+ Solves the least squares system of a relaxation times array and evaluates
+ the weighted residual and its variable projection Jacobian (Kaufman), using
+ the factorization of the system for the projection. A singular system gives
+ an infinite residual, which the optimizer rejects as a step
+
+ logp - log10 of the relaxation times
+ time - time array
+ tension - tension array
+ kz - deformation ratio
+ eInf - the given equilibrium module, or None to determinate it
+ weights - optional sample weights array
+
+ Returns - a tuple containing: the modules (E_inf first when it is determinated),
+ the matrix A, the vector B, the residual array and the (samples, num) Jacobian
+'''
+def projection(logp, time, tension, kz, eInf, weights):
+    pp = 10**np.asarray(logp, dtype=float)
+    sw = np.ones(len(time)) if weights is None else np.sqrt(weights)
+
+    # the design matrix is shared by the system and the residual
+    xx = st.designMatrix(time, pp)
+    if eInf is None:
+        basis = xx
+        target = tension
+    else:
+        basis = xx[:, 1:]
+        target = tension - kz*eInf*time
+
+    # matrixA, vectorB (or matrixAred, vectorBred)
+    aa = kz*st.gramMatrix(basis, weights)
+    bb = basis.T @ st.weightedTension(target, weights)
+    fac = st.choleskyFactor(aa[np.newaxis])
+    ee = st.choleskySolve(fac, bb[np.newaxis])[0]
+    if fac.singular[0]:
+        return (ee, aa, bb, np.full(len(time), np.inf), np.zeros((len(time), len(pp))))
+
+    rr = sw*(target - kz*(basis @ ee))
+
+    # derivative of each term kz*E_i*p_i*(1-exp(-t/p_i)) on log10(p_i)
+    ex = np.exp(-time[:, np.newaxis]/pp)
+    dphi = (-np.expm1(-time[:, np.newaxis]/pp) - time[:, np.newaxis]/pp*ex)*pp*np.log(10)
+    mm = kz*sw[:, np.newaxis]*dphi*(ee if eInf is not None else ee[1:])
+
+    # minus its part orthogonal to the basis: M - Y (Y^T Y)^-1 Y^T M, with
+    # Y = kz*W^1/2*basis and Y^T Y = kz*A, one more substitution per column
+    zz = st.choleskySolve(fac, (basis.T @ (sw[:, np.newaxis]*mm))[np.newaxis])[0]
+    jac = -(mm - kz*sw[:, np.newaxis]*(basis @ zz))
+
+    return (ee, aa, bb, rr, jac)
+
+'''
+ Optimizes the relaxation times by variable projection (scipy least_squares,
+ trust region reflective, on log10(p))
+
+ time - time array
+ tension - tension array
+ kz - deformation ratio
+ pp - starting relaxation times array
+ eInf - the given equilibrium module, or None to determinate it
+ weights - optional sample weights array
+ maxSolves - limit of the system solves
+ stats - optional SearchStats counting the solves
+ progress - optional function called as progress(solves, maxSolves, None)
+ after each solve, and as progress(solves, solves, None) at the end
+ cancel - optional threading.Event, SearchCancelled is raised once it is set
+
+ Returns - a tuple containing: the relaxation times, in increasing order, the
+ modules, the matrix A and the vector B of the optimum
+'''
+def optimizeRelaxationTimes(time, tension, kz, pp, eInf=None, weights=None, maxSolves=MAX_SOLVES, stats=None,
+                            progress=None, cancel=None):
+    # scipy is loaded on first use
+    from scipy.optimize import least_squares
+
+    tt = np.asarray(time, dtype=float)
+    ss = np.asarray(tension, dtype=float)
+    ww = None if weights is None else np.asarray(weights, dtype=float)
+
+    # the residual and the Jacobian of a point come from the same solve
+    last = {}
+    solves = [0]
+    def evaluate(logp):
+        key = logp.tobytes()
+        if key not in last:
+            pr.checkCancelled(cancel)
+            last.clear()
+            last[key] = projection(logp, tt, ss, kz, eInf, ww)
+            solves[0] += 1
+            if progress is not None:
+                progress(solves[0], maxSolves, None)
+        return last[key]
+
+    x0 = np.clip(np.log10(np.asarray(pp, dtype=float)), *LOG_BOUNDS)
+    if not np.all(np.isfinite(evaluate(x0)[3])):
+        raise ValueError('the starting relaxation times give a singular system')
+    sol = least_squares(lambda x: evaluate(x)[3], x0, jac=lambda x: evaluate(x)[4],
+                        bounds=LOG_BOUNDS, method='trf', max_nfev=maxSolves)
+
+    ee, aa, bb, _, _ = evaluate(sol.x)
+    if stats is not None:
+        stats.count('optimizer_solves', solves[0])
+    if progress is not None:
+        # converged before the limit
+        progress(solves[0], solves[0], None)
+
+    # relaxation times in increasing order, the modules follow them
+    order = np.argsort(sol.x)
+    perm = order if eInf is not None else np.concatenate(([0], order + 1))
+
+    return (10**sol.x[order], ee[perm], aa[np.ix_(perm, perm)], bb[perm])
+
+'''
+ Calculates the relaxation times by the continuous search: a grid search with
+ the first step of START_STEPS with a nonsingular candidate gives the lattice
+ point of smallest residual, from which the relaxation times are optimized by
+ variable projection
+
+ time - time values array
+ tension - tension values array
+ kz - deformation ratio
+ num - number of terms in Prony series
+ eInf - the given equilibrium module, or None to determinate it
+ workers, threads - of the starting grid search, as in prony.getRelaxationTimes
+ stats - optional SearchStats
+ progress - optional function called as progress(solves, maxSolves, None)
+ during the optimization
+ cancel - optional threading.Event, prony.SearchCancelled is raised once it is set
+ weights - optional sample weights array (prony.logTimeBins)
+ maxSolves - limit of the optimizer system solves
+ archive - optional .npy file receiving the candidates of the starting grid
+ (prony.writeArchive)
+
+ Returns - a prony.Relaxation collection, scored at the optimum
+'''
+def getRelaxationTimesContinuous(time, tension, kz, num, eInf=None, workers=1, threads=None, stats=None,
+                                 progress=None, cancel=None, weights=None, maxSolves=MAX_SOLVES, archive=None):
+    tt = np.asarray(time, dtype=float)
+    ss = np.asarray(tension, dtype=float)
+
+    with sst.run(stats):
+        for step in START_STEPS:
+            table = pr.relaxationTimesTable(step)
+            cand = pr.searchCandidates(tt, ss, table, kz, num, eInf, workers, threads, stats,
+                                       None, cancel, weights)
+            if not np.all(cand.singular):
+                break
+        if archive is not None:
+            pr.writeArchive(archive, cand, num, eInf is not None)
+        with sst.stage(stats, 'selection'):
+            # residual of each nonsingular candidate from its tension
+            nonsingular = np.flatnonzero(~cand.singular)
+            if len(nonsingular) == 0:
+                raise ValueError('no nonsingular candidate to start the optimization')
+            rss = [pr.resultResidual(tt, ss, pr.relaxationResult(cand, k, kz, num, eInf), num, weights)
+                   for k in nonsingular]
+            k = int(nonsingular[np.argmin(rss)])
+
+        with sst.stage(stats, 'optimization'):
+            pp, ee, aa, bb = optimizeRelaxationTimes(tt, ss, kz, cand.relaxation_times[k], eInf, weights,
+                                                     maxSolves, stats, progress, cancel)
+
+    # the batched r-squared of candidateScores assumes the equally spaced
+    # log(p) of the grid, the optimized times are regressed as they are
+    _, cov, _, _ = pr.candidateScores(ee[np.newaxis], np.zeros(1, dtype=bool), num, eInf)
+    if eInf is None:
+        rsq = pr.polynomialRegression(pp, np.abs(ee[1:]), 3).r_squared
+        return pr.Relaxation(pp, ee[1:], ee[0], kz, float(rsq), float(cov[0]))
+
+    return pr.Relaxation(pp, ee, eInf, kz, 0.0, float(cov[0]))
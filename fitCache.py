@@ -0,0 +1,133 @@
+# Persistent cache of relaxation times search results
+#
+# Each result is stored in a .npz file named by the sha256 of the time and
+# tension arrays, the search parameters and the engine version, so running
+# the same test with the same settings again reads the result back instead
+# of searching. The least recently used entries are removed once the cache
+# grows beyond its size limit.
+
+import os
+import json
+import zipfile
+import hashlib
+import tempfile
+
+import numpy as np
+
+import prony as pr
+import system as st
+
+# default directory, overridden by the VISCOMODULE_CACHE environment variable
+DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'viscomodule')
+
+# default size limit in bytes
+MAX_BYTES = 256*1024*1024
+
+class FitCache:
+
+    '''
+     directory - cache directory, None for VISCOMODULE_CACHE or DIRECTORY
+     maxBytes - size limit, the least recently used entries are removed beyond it
+    '''
+    def __init__(self, directory=None, maxBytes=MAX_BYTES):
+        self.directory = directory or os.environ.get('VISCOMODULE_CACHE') or DIRECTORY
+        self.maxBytes = maxBytes
+
+    '''
+     Builds the key of a search: the sha256 of the engine version, the
+     singular floor (system.RCOND), the parameters and the contents of the arrays
+
+     time - time values array
+     tension - tension values array
+     params - dictionary of the search parameters, json serializable
+
+     Returns - the key as an hexadecimal string
+    '''
+    def key(self, time, tension, params):
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'engine': pr.ENGINE_VERSION, 'rcond': st.RCOND, 'params': params}, sort_keys=True).encode())
+        for a in (time, tension):
+            a = np.ascontiguousarray(a, dtype=float)
+            digest.update(str(a.shape).encode())
+            digest.update(a.tobytes())
+
+        return digest.hexdigest()
+
+    # path of the entry of a key
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    '''
+     Reads the result of a key; a missing or unreadable entry is a miss
+
+     key - entry key
+
+     Returns - a prony.Relaxation collection or None
+    '''
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                result = pr.Relaxation(*[data[f] if data[f].ndim else data[f][()] for f in pr.Relaxation._fields])
+            # the modification time orders the entries for the eviction
+            os.utime(path)
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+        return result
+
+    '''
+     Stores the result of a key, then removes the least recently used
+     entries beyond the size limit
+
+     key - entry key
+     result - prony.Relaxation collection
+    '''
+    def put(self, key, result):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # written aside and renamed, so readers never see a partial entry
+        fd, temp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **{field: np.asarray(value) for field, value in result._asdict().items()})
+            os.replace(temp, self.path(key))
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+        self.evict()
+
+    # removes the least recently used entries beyond the size limit
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith('.npz'):
+                    try:
+                        stat = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, e.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+            total -= size
+
+    # removes every entry
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,157 @@
+# Parallel relaxation times search
+#
+# The rows of the relaxation times table (the mantissas) are spread over a
+# process pool. Each worker builds the Gram index of its rows from the time,
+# tension and optional weights arrays, shared with the workers through shared memory,
+# and evaluates the candidates of every exponent window on those rows, for
+# one or several numbers of terms. The candidates are then merged back in the grid search order, so the selection
+# is the same as the serial search.
+
+import os
+import contextlib
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import prony as pr
+import system as st
+import searchStats as sst
+
+# environment variables read by the BLAS libraries at load time
+BLAS_THREADS_VARS = ['OMP_NUM_THREADS',
+                     'OPENBLAS_NUM_THREADS',
+                     'MKL_NUM_THREADS',
+                     'BLIS_NUM_THREADS',
+                     'VECLIB_MAXIMUM_THREADS',
+                     'NUMEXPR_NUM_THREADS']
+
+# worker state, set by the pool initializer
+_shared = None
+_inputs = None
+
+'''
+ Sets the BLAS thread count of the processes started inside the context
+
+ threads - number of BLAS threads of each process
+'''
+@contextlib.contextmanager
+def blasThreads(threads):
+    saved = {var: os.environ.get(var) for var in BLAS_THREADS_VARS}
+    for var in BLAS_THREADS_VARS:
+        os.environ[var] = str(threads)
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+'''
+ Attaches the worker process to the shared time and tension arrays
+
+ name - shared memory block name
+ shape - shape of the (2, samples) time and tension array, or (3, samples)
+ with the weights
+ rcond - singular floor of the parent process (system.RCOND)
+'''
+def initWorker(name, shape, rcond):
+    global _shared, _inputs
+    _shared = shared_memory.SharedMemory(name=name)
+    _inputs = np.ndarray(shape, dtype=float, buffer=_shared.buf)
+    st.RCOND = rcond
+
+'''
+ Evaluates the candidates of a block of relaxation times table rows
+
+ task - a tuple containing: the table rows, kz, the numbers of terms, eInf
+ and a boolean, True to collect SearchStats
+
+ Returns - a tuple containing: the list of Candidates collections of the
+ block, in the grid search order, one per number of terms, and the
+ SearchStats of the block or None
+'''
+def evaluateRows(task):
+    table, kz, nums, eInf, instrument = task
+    stats = sst.SearchStats() if instrument else None
+
+    with sst.stage(stats, 'assembly'):
+        weights = _inputs[2] if len(_inputs) > 2 else None
+        index = st.gramIndex(_inputs[0], _inputs[1], table, weights=weights)
+    cands = []
+    for num in nums:
+        rows, cols = pr.candidatePositions(num, len(table))
+        cands.append(pr.evaluateCandidates(index, rows, cols, kz, num, eInf, stats))
+
+    if stats is not None:
+        stats.process_peak_memory = sst.peakResidentMemory()
+
+    return (cands, stats)
+
+'''
+ Evaluates every candidate of the grid search for several numbers of terms
+ over a process pool, each worker sharing the Gram index of its rows among
+ them (prony.searchTermsCandidates)
+
+ time - time values array
+ tension - tension values array
+ table - relaxation times table (prony.relaxationTimesTable)
+ kz - deformation ratio
+ nums - numbers of terms in Prony series
+ eInf - the given equilibrium module, or None to determinate it
+ workers - number of worker processes, None for one per core
+ threads - BLAS threads of each worker, None to share the cores among the workers
+ stats - optional SearchStats; the stage times of the workers are added up
+ progress - optional function called as progress(evaluated, total, best)
+ as the row blocks complete, see prony.reportTermsProgress
+ cancel - optional object with an is_set() method; the pool is terminated
+ and SearchCancelled raised once it is set
+ weights - optional sample weights array
+
+ Returns - a list of Candidates collections, in the grid search order, one
+ per number of terms
+'''
+def evaluateTermsParallel(time, tension, table, kz, nums, eInf=None, workers=None, threads=None, stats=None,
+                          progress=None, cancel=None, weights=None):
+    cores = os.cpu_count() or 1
+    if workers is None:
+        workers = cores
+    workers = max(1, min(workers, len(table)))
+    if threads is None:
+        threads = max(1, cores // workers)
+
+    arrays = [time, tension] if weights is None else [time, tension, weights]
+    inputs = np.vstack([np.asarray(a, dtype=float) for a in arrays])
+    shm = shared_memory.SharedMemory(create=True, size=inputs.nbytes)
+    try:
+        np.ndarray(inputs.shape, dtype=float, buffer=shm.buf)[:] = inputs
+
+        # contiguous row blocks, so the merge keeps the table row order;
+        # one row per block when reporting progress or checking a cancel
+        nblocks = workers if progress is None and cancel is None else len(table)
+        tasks = [(block, kz, list(nums), eInf, stats is not None) for block in np.array_split(table, nblocks) if len(block) > 0]
+
+        # spawned workers load BLAS with the thread count set here
+        ctx = mp.get_context('spawn')
+        with blasThreads(threads):
+            pool = ctx.Pool(workers, initializer=initWorker, initargs=(shm.name, inputs.shape, st.RCOND))
+        total = sum(len(pr.candidatePositions(num, len(table))[0]) for num in nums)
+        results = []
+        with pool:
+            # ordered results, the pool is terminated on leaving the block
+            for result in pool.imap(evaluateRows, tasks):
+                pr.checkCancelled(cancel)
+                results.append(result)
+                if progress is not None:
+                    pr.reportTermsProgress([cands for cands, _ in results], nums, kz, eInf, total, progress)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if stats is not None:
+        for _, workerStats in results:
+            stats.merge(workerStats)
+
+    return [pr.mergeCandidates([cands[i] for cands, _ in results], num) for i, num in enumerate(nums)]
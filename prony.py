@@ -6,28 +6,102 @@
 #
 # tension
 # prony
+# linearTimes
+# logTimes
+# arrayTimes
+# simulationTimes
+# simulationChunks
+# writeSimulation
 # plot
+# relaxationTimesTable
+# mantissaTable
+# windowCount
+# candidatePositions
+# relaxationTimesGrid
+# candidateSystems
+# evaluateCandidates
+# solveShared
+# evaluateSpecimens
+# evaluateEinfs
+# evaluateRates
+# candidateScores
+# selectCandidate
+# acceptedCandidates
+# selectAccepted
+# candidateResiduals
+# checkCancelled
+# mergeCandidates
+# reportProgress
+# reportTermsProgress
+# searchCandidates
+# searchTermsCandidates
+# searchShared
+# searchSpecimensCandidates
+# searchEinfsCandidates
+# searchRatesCandidates
+# relaxationResult
+# writeArchive
+# readArchive
 # getRelaxationTimes
 # getRelaxationTimesEinf
+# getRelaxationTimesTerms
+# getRelaxationTimesSpecimens
+# getRelaxationTimesEinfSweep
+# getRelaxationTimesRates
+# selectResults
+# logTimeBins
+# decimationIndex
+# resultTension
+# resultResidual
+# compareDecimation
+# polynomialRegression
+# rsquared
+# regressionResidual
+# rsquaredBatch
 # isAllPositiveArray
+# isNumericRow
+# readCSVArray
 # readCSV
+# readCSVSpecimens
+# checkTestOutput
+# formatCSV
+# writeCSV
+# writeColumns
 # writeTexTable
 # toFloatArray
 # main
 
 # import modules
+import os
 import numpy as np
-import scipy.linalg as sc
-import math as mt
-import matplotlib.pyplot as plt
 import system as st
-import csv
+import searchStats as sst
 import collections as col
+from time import perf_counter
+
+# number format of the csv files written, exact on reading back
+CSV_FORMAT = '%.17g'
+
+# time grids of the test simulation
+GRIDS = ['linear', 'log', 'array']
+
+# decades of the log time grid before the test duration, by default
+LOG_DECADES = 6
+
+# exponents of the relaxation times table: 10^-6 to 10^10
+MIN_EXPONENT = -6
+MAX_EXPONENT = 10
+
+# version of the relaxation times search, part of the fit cache keys:
+# change it whenever the search gives different results for the same input
+# or the Relaxation fields change
+ENGINE_VERSION = 4
 
 # define here auxiliary functions
 
 """
  Francisco adapted interpolation function
+ Evaluated by blocks of chunk times, so the memory does not grow with the time array
  
  time - time array
  kz - deformation constant rate
@@ -35,64 +109,186 @@ import collections as col
  eArray - spring constant array (relaxation modulus)
  pArray - relaxation time array
  num - number of terms in Prony series
+ out - optional float array to write the result into
+ chunk - number of times evaluated at once
  
   Returns - array with values of tension
 """
-def tension(time, kz, eInf, eArray, pArray, num):
-        i = 0
-        tension = []
-        
-        while i < len(time):
-                j = 0
-                
-                x1 = 0
-                while j < num:
-                        # auxiliary variable
-                        x1 = x1 + eArray[j]*pArray[j]*(1 - mt.exp(-time[i]/pArray[j]))
-                        
-                        # appends the result to sumArray
-                        j = j+1
-                
-                # auxiliary variable, means the tension
-                x2 = kz*(eInf*time[i] + x1)
-                
-                # appends the result to tension array
-                tension.append(x2)
-                i = i+1
-                        
-        return tension
+def tension(time, kz, eInf, eArray, pArray, num, out=None, chunk=65536):
+        tt = np.asarray(time, dtype=float)
+        pp = np.asarray(pArray[:num], dtype=float)
+
+        # coefficients of the time and of each p*(1-exp(-t/p)) column
+        cc = kz*np.concatenate(([eInf], np.asarray(eArray[:num], dtype=float)))
+
+        if out is None:
+                out = np.empty(shape=(len(tt)), dtype=float)
+
+        for i in np.arange(0, len(tt), chunk):
+                # tension = kz*(eInf*t + sum(E*p*(1-exp(-t/p))))
+                out[i:i+chunk] = st.designMatrix(tt[i:i+chunk], pp) @ cc
+
+        return out
 
 """
  The Prony series function
+ Evaluated by blocks of chunk times, so the memory does not grow with the time array
  
  time - time array
  eInf - single spring constant
  eArray - spring constant array (relaxation modulus)
  pArray - relaxation time array
  num - number of terms in Prony series
+ out - optional float array to write the result into
+ chunk - number of times evaluated at once
  
   Returns - array with values of tension
 """
-def prony(time, eInf, eArray, pArray, num):
+def prony(time, eInf, eArray, pArray, num, out=None, chunk=65536):
+        tt = np.asarray(time, dtype=float)
+        ee = np.asarray(eArray[:num], dtype=float)
+        pp = np.asarray(pArray[:num], dtype=float)
+
         # initializes the prony constants array
-        pronyArray = np.empty(shape=(len(time)), dtype=float)
-                              
-        for i in np.arange(0, len(time), 1):
+        if out is None:
+                out = np.empty(shape=(len(tt)), dtype=float)
 
-                # the summatory term of prony series equation
-                ss = 0
-                for j in np.arange(0, num, 1):
-                        ss = ss + eArray[j]*mt.exp(-time[i]/pArray[j])
+        for i in np.arange(0, len(tt), chunk):
+                # E(t) = eInf + sum(E*exp(-t/p))
+                bs = np.exp(-tt[i:i+chunk, np.newaxis]/pp)
+                out[i:i+chunk] = bs @ ee + eInf
 
-                # sums the summatory on the i-th time on the E_inf
-                ee = eInf + ss
+        return out
 
-                # appends the i-th prony constant in function of time
-                pronyArray[i] = ee
+"""
+ Generates the linear time grid of a test simulation by blocks, the same
+ values as np.linspace(0, duration, readings)
 
-        return pronyArray
+ duration - test duration
+ readings - number of times
+ chunk - number of times of each block
+
+ Returns - a generator of time arrays
+"""
+def linearTimes(duration, readings, chunk=65536):
+        step = duration/(readings - 1) if readings > 1 else duration
+        for i in np.arange(0, readings, chunk):
+                tt = np.arange(i, min(i + chunk, readings), dtype=float)*step
+                if i + chunk >= readings and readings > 1:
+                        tt[-1] = duration
+                yield tt
+
+"""
+ Generates the log-spaced time grid of a test simulation by blocks: the
+ time 0 followed by readings-1 log-spaced times from first to duration, so
+ the short times are sampled as finely as the long ones
+
+ duration - test duration
+ readings - number of times
+ first - first time after 0, by default LOG_DECADES decades before the duration
+ chunk - number of times of each block
+
+ Returns - a generator of time arrays
+"""
+def logTimes(duration, readings, first=None, chunk=65536):
+        if first is None:
+                first = duration*10.0**-LOG_DECADES
+        if not 0 < first < duration:
+                raise ValueError('the first time must be between 0 and the duration')
+
+        lo = np.log10(first)
+        step = (np.log10(duration) - lo)/(readings - 2) if readings > 2 else 0.0
+        for i in np.arange(0, readings, chunk):
+                ii = np.arange(i, min(i + chunk, readings), dtype=float)
+                tt = 10**(lo + (ii - 1)*step)
+                if i == 0:
+                        tt[0] = 0.0
+                if i + chunk >= readings and readings > 1:
+                        tt[-1] = duration
+                yield tt
+
+"""
+ Generates a given time grid of a test simulation by blocks
+
+ times - time values array, not negative and not decreasing
+ chunk - number of times of each block
+
+ Returns - a generator of time arrays
+"""
+def arrayTimes(times, chunk=65536):
+        tt = np.asarray(times, dtype=float)
+        if np.isnan(tt).any() or (tt < 0).any():
+                raise ValueError('the times must be numbers not below 0')
+        if (np.diff(tt) < 0).any():
+                raise ValueError('the times must not decrease')
+
+        for i in np.arange(0, len(tt), chunk):
+                yield tt[i:i+chunk]
+
+"""
+ Generates the time grid of a test simulation by blocks
+
+ grid - 'linear', 'log' or 'array' (GRIDS)
+ duration - test duration, for the linear and log grids
+ readings - number of times, for the linear and log grids
+ times - time values array, for the array grid
+ first - first time after 0 of the log grid (logTimes)
+ chunk - number of times of each block
+
+ Returns - a generator of time arrays
+"""
+def simulationTimes(grid, duration=None, readings=None, times=None, first=None, chunk=65536):
+        if grid == 'array':
+                return arrayTimes(times, chunk)
+
+        if grid not in GRIDS:
+                raise ValueError('unknown time grid: {}'.format(grid))
+        if duration is None or duration <= 0 or readings is None or readings < 2:
+                raise ValueError('the time grid needs a positive duration and at least two readings')
+
+        if grid == 'log':
+                return logTimes(duration, int(readings), first, chunk)
+
+        return linearTimes(duration, int(readings), chunk)
+
+"""
+ Simulates a creep test by blocks, so the memory does not grow with the
+ number of readings
+
+ times - iterable of time arrays, e.g. simulationTimes
+ kz - deformation constant rate
+ eInf - single spring constant
+ eArray - spring constant array (relaxation modulus)
+ pArray - relaxation time array
+ num - number of terms in Prony series
+
+ Returns - a generator of (2, block) numpy float arrays, the times and their tensions
+"""
+def simulationChunks(times, kz, eInf, eArray, pArray, num):
+        for tt in times:
+                block = np.empty((2, len(tt)), dtype=float)
+                block[0] = tt
+                tension(tt, kz, eInf, eArray, pArray, num, out=block[1])
+                yield block
+
+"""
+ Writes a creep test simulation to a csv file block by block, with the
+ time and tension columns
+
+ fileName - csv file name
+ chunks - iterable of (2, block) arrays, e.g. simulationChunks
+
+ Returns - the number of rows written
+"""
+def writeSimulation(fileName, chunks):
+        rows = 0
+        with open(fileName, 'w', buffering=1 << 20) as csvFile:
+                for block in chunks:
+                        csvFile.write(formatCSV(block.T))
+                        rows += block.shape[1]
+
+        return rows
 
-        
 """
  Plot time x tension curve
  
@@ -100,6 +296,8 @@ def prony(time, eInf, eArray, pArray, num):
  tension - tension array
 """
 def plot(time, tension):
+        # matplotlib is loaded on first use
+        import matplotlib.pyplot as plt
         
         # Get the coefficients from a least squares polynomial fit with degree 2
         coef = np.polyfit(time, tension, 2)
@@ -124,202 +322,988 @@ def plot(time, tension):
         plt.show()
 
 """
- Calculates the best relaxation times array and the best input deformation rate
- for the given Prony series number of terms and time and tension values array.
- Iterates through the relaxation times array in the defined exponent range
- and the deformation rate values from 1.0 to 4.0.
+ Builds the table of every distinct relaxation time tested by the grid search.
+ Row j holds the j-th mantissa, from 1.0 to 9.0 by step, times the decades
+ 10^-6, ... , 10^10: p = mantissa*10^k
+
+ step - mantissa step
+
+ Returns - a (mantissas, 17) numpy float array
+"""
+def relaxationTimesTable(step):
+
+        # set pp mantissa values
+        # value range: 1.0 to 9.0 by step
+        # e.g. 1E3, 2E3, 3E4...
+        ppmant = np.arange(1.0, 10.0, step=step)
+
+        return mantissaTable(ppmant)
+
+"""
+ Builds the relaxation times table of some mantissas, one row per mantissa,
+ as relaxationTimesTable
+
+ mantissas - mantissas array, from 1.0 to 10.0 (exclusive)
+
+ Returns - a (mantissas, 17) numpy float array
+"""
+def mantissaTable(mantissas):
+        exponents = np.arange(MIN_EXPONENT, MAX_EXPONENT+1, 1)
+
+        return np.asarray(mantissas, dtype=float)[:, np.newaxis]*float(10)**exponents
+
+"""
+ Gets the number of exponent windows of the grid search, the windows of num
+ consecutive relaxation times table columns, the last one ending at 10^10
+
+ num - number of terms in Prony series
+
+ Returns - an integer
+"""
+def windowCount(num):
+        return (MAX_EXPONENT - MIN_EXPONENT + 1) - num + 1
+
+"""
+ Gets the relaxation times table positions of every candidate of the grid
+ search, in the search order: exponent windows, then mantissas. The window
+ starting at 10^(-6+i) takes the num consecutive columns from column i,
+ up to the window ending at 10^10
+
+ num - number of terms in Prony series
+ nrows - number of mantissas (table rows)
+
+ Returns - a tuple containing the table row and the first table column of each candidate
+"""
+def candidatePositions(num, nrows):
+
+        nwin = windowCount(num)
+
+        rows = np.tile(np.arange(0, nrows, 1), nwin)
+        cols = np.repeat(np.arange(0, nwin, 1), nrows)
+
+        return (rows, cols)
+
+"""
+ Builds the relaxation times tested by the grid search. Each exponent window
+ starts at 10^start, start = -6, ... , 11-num, and each mantissa from 1.0
+ to 9.0 by step shifts the whole window: p_k = mantissa*10^(start+k)
+
+ num - number of terms in Prony series
+ step - mantissa step
+
+ Returns - a (windows, mantissas, num) numpy float array
+"""
+def relaxationTimesGrid(num, step):
+        table = relaxationTimesTable(step)
+        rows, cols = candidatePositions(num, len(table))
+        sel = cols[:, np.newaxis] + np.arange(0, num, 1)
+
+        return table[rows[:, np.newaxis], sel].reshape(-1, len(table), num)
+
+Candidates = col.namedtuple('Candidates',
+                            ['relaxation_times',
+                             'modules',
+                             'matrixA',
+                             'vectorB',
+                             'singular',
+                             'r_squared',
+                             'variation_coefficient',
+                             'exponent_mean',
+                             'exponent_inf'])
+
+"""
+ Gathers the systems of a batch of candidate relaxation times arrays from
+ the Gram index
+
+ index - Gram index of the time and tension values arrays (system.gramIndex)
+ rows - (candidates) relaxation times table row of each candidate
+ cols - (candidates) first relaxation times table column of each candidate
+ kz - deformation ratio
+ num - number of terms in Prony series
+ eInf - the given equilibrium module, or None to determinate it
+ stats - optional SearchStats collecting the assembly time
+
+ Returns - a tuple containing: the (candidates, num) relaxation times, the
+ matrices A and the vectors B, with a last specimens axis when the index has
+ several specimens
+"""
+def candidateSystems(index, rows, cols, kz, num, eInf=None, stats=None):
+
+        # relaxation times arrays
+        pps = index.relaxation_times[np.asarray(rows)[:, np.newaxis],
+                                     np.asarray(cols)[:, np.newaxis] + np.arange(0, num, 1)]
+
+        # set matrices and vectors B
+        with sst.stage(stats, 'assembly'):
+                if eInf is None:
+                        mtx = st.indexMatrixA(index, kz, rows, cols, num)
+                        vec = st.indexVectorB(index, rows, cols, num)
+                else:
+                        mtx = st.indexMatrixAred(index, kz, rows, cols, num)
+                        vec = st.indexVectorBred(index, rows, cols, eInf, kz, num)
+
+        return (pps, mtx, vec)
+
+"""
+ Evaluates a batch of candidate relaxation times arrays: gathers the
+ (candidates x n x n) systems from the Gram index, solves them in a single
+ call and computes the scores used by the selection criteria
+
+ index - Gram index of the time and tension values arrays (system.gramIndex)
+ rows - (candidates) relaxation times table row of each candidate
+ cols - (candidates) first relaxation times table column of each candidate
+ kz - deformation ratio
+ num - number of terms in Prony series
+ eInf - the given equilibrium module, or None to determinate it
+ stats - optional SearchStats collecting stage times and candidate counts
+
+ Returns - a collection of arrays, one entry per candidate
+"""
+def evaluateCandidates(index, rows, cols, kz, num, eInf=None, stats=None):
+        pps, mtx, vec = candidateSystems(index, rows, cols, kz, num, eInf, stats)
+
+        # solve
+        with sst.stage(stats, 'solve'):
+                ee, singular = st.solveBatch(mtx, vec)
+
+        if stats is not None:
+                stats.count('evaluated', len(ee))
+                stats.count('singular', np.count_nonzero(singular))
+
+        with sst.stage(stats, 'regression'):
+                rsq, expcov, expmen, expinf = candidateScores(ee, singular, num, eInf)
+
+        return Candidates(pps, ee, mtx, vec, singular, rsq, expcov, expmen, expinf)
+
+"""
+ Solves a batch of candidate systems sharing the matrices A against several
+ vectors B: each matrix is factorized once, then the substitutions of each
+ vector B run on the factor, as in system.solveBatch, so each solution gets
+ the same round-off as when it is solved alone
+
+ pps - (candidates, num) relaxation times arrays
+ mtx - (candidates, n, n) matrices A
+ vecs - list of (candidates, n) vectors B
+ num - number of terms in Prony series
+ eInfs - the given equilibrium module of each vector B, or None where it is
+ determinated
+ stats - optional SearchStats collecting stage times and candidate counts
+
+ Returns - a list of Candidates collections, one per vector B; the
+ relaxation times and the matrices A are shared among them
+"""
+def solveShared(pps, mtx, vecs, num, eInfs, stats=None):
+        with sst.stage(stats, 'solve'):
+                fac = st.choleskyFactor(mtx)
+                singular = fac.singular
+                ees = []
+                for vec in vecs:
+                        ee = st.choleskySolve(fac, vec)
+                        ee[singular] = 1.0
+                        ees.append(ee)
+
+        if stats is not None:
+                stats.count('evaluated', len(mtx)*len(vecs))
+                stats.count('singular', np.count_nonzero(singular)*len(vecs))
+
+        cands = []
+        with sst.stage(stats, 'regression'):
+                for ee, vec, eInf in zip(ees, vecs, eInfs):
+                        rsq, expcov, expmen, expinf = candidateScores(ee, singular, num, eInf)
+                        cands.append(Candidates(pps, ee, mtx, vec, singular, rsq, expcov, expmen, expinf))
+
+        return cands
+
+"""
+ Evaluates a batch of candidate relaxation times arrays for several
+ specimens sharing the time array: the matrices A do not depend on the
+ tension, so each one is factorized once for the vectors B of every
+ specimen (solveShared)
+
+ index - Gram index of the time array and the (specimens, samples) tension
+ array (system.gramIndex)
+
+ The other arguments as in evaluateCandidates
+
+ Returns - a list of Candidates collections, one per specimen
+"""
+def evaluateSpecimens(index, rows, cols, kz, num, eInf=None, stats=None):
+        pps, mtx, vec = candidateSystems(index, rows, cols, kz, num, eInf, stats)
+        vecs = [np.ascontiguousarray(vec[:, :, j]) for j in np.arange(0, vec.shape[2], 1)]
+
+        return solveShared(pps, mtx, vecs, num, [eInf]*len(vecs), stats)
+
+"""
+ Evaluates a batch of candidate relaxation times arrays for several given
+ equilibrium modules: the matrices A (matrixAred) do not depend on E_inf,
+ so each one is factorized once for the vectors B of every E_inf
+ (solveShared)
+
+ eInfs - the given equilibrium modules
+
+ The other arguments as in evaluateCandidates
+
+ Returns - a list of Candidates collections, one per E_inf
+"""
+def evaluateEinfs(index, rows, cols, kz, num, eInfs, stats=None):
+        pps, mtx, vec = candidateSystems(index, rows, cols, kz, num, eInfs[0], stats)
+        with sst.stage(stats, 'assembly'):
+                vecs = [vec] + [st.indexVectorBred(index, rows, cols, eInf, kz, num) for eInf in eInfs[1:]]
+
+        return solveShared(pps, mtx, vecs, num, eInfs, stats)
+
+"""
+ Evaluates a batch of candidate relaxation times arrays for several
+ deformation rates. The rate kz only scales the matrices A, so each matrix
+ is factorized once with kz = 1 and the modules of every rate follow from
+ two solves: E = A^-1 u / kz without E_inf, E = A^-1 u / kz - E_inf A^-1 v
+ with a given E_inf, where u is the tension part and v the time part of the
+ vector B. The scores are computed per rate, since the selection criteria
+ depend on the scale of the modules. The tension fitted at a rate matches a
+ single fit at that rate to round-off (residuals within 1e-10 relative on
+ the project's curves), while single modules of ill conditioned systems may
+ differ far more, so a selection close to a criterion limit could differ
+
+ kzs - deformation ratios
+
+ The other arguments as in evaluateCandidates
+
+ Returns - a list of Candidates collections, one per rate
+"""
+def evaluateRates(index, rows, cols, kzs, num, eInf=None, stats=None):
+        # with a given E_inf, the tension part of vectorBred
+        pps, mtx, vec = candidateSystems(index, rows, cols, 1.0, num, None if eInf is None else 0.0, stats)
+        if eInf is not None:
+                with sst.stage(stats, 'assembly'):
+                        gt = st.indexVectorTime(index, rows, cols, num)
+
+        with sst.stage(stats, 'solve'):
+                fac = st.choleskyFactor(mtx)
+                singular = fac.singular
+                uu = st.choleskySolve(fac, vec)
+                if eInf is not None:
+                        vv = st.choleskySolve(fac, gt)
+
+        if stats is not None:
+                stats.count('evaluated', len(mtx)*len(kzs))
+                stats.count('singular', np.count_nonzero(singular)*len(kzs))
+
+        cands = []
+        with sst.stage(stats, 'regression'):
+                for kz in kzs:
+                        if eInf is None:
+                                ee, vb = uu/kz, vec
+                        else:
+                                # vectorBred of the rate
+                                ee, vb = uu/kz - eInf*vv, vec - kz*eInf*gt
+                        ee[singular] = 1.0
+                        rsq, expcov, expmen, expinf = candidateScores(ee, singular, num, eInf)
+                        cands.append(Candidates(pps, ee, kz*mtx, vb, singular, rsq, expcov, expmen, expinf))
+
+        return cands
+
+"""
+ Computes the scores of the selection criteria of a batch of solutions
+
+ ee - (candidates x n) modules, E_inf first when it is determinated
+ singular - (candidates) boolean array of the singular systems
+ num - number of terms in Prony series
+ eInf - the given equilibrium module, or None if it is determinated
+
+ Returns - a tuple containing: the r-squared of the 3th degree polynomial
+ regression of the modules (zero with a given E_inf), the variation
+ coefficient and the mean of the modules exponents and the E_inf exponent
+"""
+def candidateScores(ee, singular, num, eInf=None):
+        # the Prony series constants, without E_inf
+        ei = ee if eInf is not None else ee[:, 1:]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+                # check the variance and variance coefficient of the exponents
+                # get the exponent array
+                expvec = np.floor(np.log10(np.abs(ei))).astype(int)
+                expstd = np.std(expvec, axis=1)
+                expmen = np.mean(expvec, axis=1)
+                expcov = expstd/expmen
+                if eInf is None:
+                        expinf = np.floor(np.log10(np.abs(ee[:, 0]))).astype(int)
+                else:
+                        expinf = np.full(len(ee), np.floor(np.log10(np.abs(eInf))).astype(int))
+
+                # fits ee values to 3th degree polynomy, against log(p)
+                rsq = np.zeros(len(ee))
+                if eInf is None:
+                        ok = ~singular
+                        rsq[ok] = rsquaredBatch(np.abs(ei[ok]), regressionResidual(num, 3))
+
+        return (rsq, expcov, expmen, expinf)
+
+"""
+ Selects the best candidate by the stop criteria. With E_inf determinated,
+ the accepted candidates must have an r-squared below 0.8, a variation
+ coefficient of the exponents above 0.10 and the E_inf exponent close to
+ the mean exponent; among them, each candidate with greater r-squared and
+ smaller variation coefficient than the current optimum replaces it.
+ With a given E_inf, the last candidate with the E_inf exponent close to
+ the mean exponent is selected
+
+ cand - a Candidates collection, in the grid search order
+ givenEinf - boolean, True if E_inf was given
+ stats - optional SearchStats counting the candidates rejected by each criterion
+
+ Returns - the index of the selected candidate
+"""
+def selectCandidate(cand, givenEinf, stats=None):
+        with sst.stage(stats, 'selection'):
+                return selectAccepted(cand, acceptedCandidates(cand, givenEinf, stats), givenEinf)
+
+"""
+ Applies the stop criteria of selectCandidate to every candidate
+
+ cand - a Candidates collection
+ givenEinf - boolean, True if E_inf was given
+ stats - optional SearchStats counting the candidates rejected by each
+ criterion; a candidate failing several criteria is counted in each of them
+
+ Returns - a boolean array, True for the accepted candidates
+"""
+def acceptedCandidates(cand, givenEinf, stats=None):
+        expmen = cand.exponent_mean
+        expinf = cand.exponent_inf
+        valid = ~cand.singular
+
+        with np.errstate(invalid='ignore'):
+                if givenEinf:
+                        rsqok = valid
+                        covok = valid
+                        expok = (0.7*expmen <= expinf) & (expinf <= 1.5*expmen)
+                else:
+                        rsqok = cand.r_squared < 0.8
+                        covok = cand.variation_coefficient > 0.10
+                        expok = (0.7*expmen <= expinf) & (expinf <= 1.3*expmen)
+
+        accepted = valid & rsqok & covok & expok
+
+        if stats is not None:
+                stats.count('rejected_r_squared', np.count_nonzero(valid & ~rsqok))
+                stats.count('rejected_variation', np.count_nonzero(valid & ~covok))
+                stats.count('rejected_exponent', np.count_nonzero(valid & ~expok))
+                stats.count('accepted', np.count_nonzero(accepted))
+
+        return accepted
+
+"""
+ Selects the best of the accepted candidates, see selectCandidate
+
+ cand - a Candidates collection, in the grid search order
+ accepted - boolean array of the accepted candidates
+ givenEinf - boolean, True if E_inf was given
+
+ Returns - the index of the selected candidate
+"""
+def selectAccepted(cand, accepted, givenEinf):
+        index = np.flatnonzero(accepted)
+        if len(index) == 0:
+                raise ValueError('no relaxation times satisfy the selection criteria')
+
+        if givenEinf:
+                return index[-1]
+
+        opt = None
+        ecopt = 1               # variation coefficient as the minimum possible: 0
+        rsopt = 0               # r-squared optimum value
+        for k in index:
+                if cand.r_squared[k] > rsopt and cand.variation_coefficient[k] < ecopt:
+                        rsopt = cand.r_squared[k]
+                        ecopt = cand.variation_coefficient[k]
+                        opt = k
+
+        if opt is None:
+                raise ValueError('no relaxation times satisfy the selection criteria')
+
+        return opt
+
+"""
+ Estimates the residual sum of squares of every candidate from its system:
+ sum(w*s^2) - kz*E.B, where s is the tension, or the tension minus
+ kz*E_inf*t with a given E_inf. Singular candidates get an infinite residual.
+ The identity only holds for an exact least squares solution, so on the ill
+ conditioned systems it is only good to rank many candidates cheaply; the
+ residual of a result is resultResidual
+
+ cand - a Candidates collection
+ time - time values array
+ tension - tension values array
+ kz - deformation ratio
+ eInf - the given equilibrium module, or None
+ weights - optional sample weights array
+
+ Returns - a (candidates) numpy float array
+"""
+def candidateResiduals(cand, time, tension, kz, eInf=None, weights=None):
+        tt = np.asarray(time, dtype=float)
+        ss = np.asarray(tension, dtype=float)
+        target = ss if eInf is None else ss - kz*eInf*tt
+
+        rss = target @ st.weightedTension(target, weights) - kz*np.einsum('ij,ij->i', cand.modules, cand.vectorB)
+        rss[cand.singular] = np.inf
+
+        return rss
+
+"""
+ Raised when a relaxation times search is cancelled
+"""
+class SearchCancelled(Exception):
+        pass
+
+"""
+ Raises SearchCancelled if the search was cancelled
+
+ cancel - object with an is_set() method, e.g. threading.Event, or None
+"""
+def checkCancelled(cancel):
+        if cancel is not None and cancel.is_set():
+                raise SearchCancelled()
+
+"""
+ Merges the Candidates of consecutive blocks of relaxation times table rows
+ into the grid search order: exponent windows, then mantissas
+
+ parts - Candidates of each row block, in table row order
+ num - number of terms in Prony series
+
+ Returns - a Candidates collection
+"""
+def mergeCandidates(parts, num):
+        nwin = windowCount(num)
+        fields = []
+        for values in zip(*parts):
+                blocks = [np.reshape(v, (nwin, -1) + np.shape(v)[1:]) for v in values]
+                merged = np.concatenate(blocks, axis=1)
+                fields.append(merged.reshape((-1,) + merged.shape[2:]))
+
+        return Candidates(*fields)
+
+"""
+ Reports the progress of a search to a callback, with the best candidate
+ among the table rows evaluated so far
+
+ parts - Candidates of the row blocks evaluated so far, in table row order
+ num - number of terms in Prony series
+ kz - deformation ratio
+ eInf - the given equilibrium module, or None
+ total - number of candidates of the whole search
+ progress - function called as progress(evaluated, total, best), best is a
+ Relaxation collection or None while no candidate is accepted
+"""
+def reportProgress(parts, num, kz, eInf, total, progress):
+        cand = mergeCandidates(parts, num)
+        givenEinf = eInf is not None
+        try:
+                k = selectAccepted(cand, acceptedCandidates(cand, givenEinf), givenEinf)
+                best = relaxationResult(cand, k, kz, num, eInf)
+        except ValueError:
+                best = None
+
+        progress(len(cand.modules), total, best)
+
+"""
+ Reports the progress of a search over several numbers of terms: as
+ reportProgress with a single number of terms, otherwise without a best
+ result, since each number of terms has its own
+
+ parts - for each row block evaluated so far, in table row order, the list
+ of its Candidates, one per number of terms
+ nums - numbers of terms in Prony series
+ kz - deformation ratio
+ eInf - the given equilibrium module, or None
+ total - number of candidates of the whole search, over every number of terms
+ progress - function called as progress(evaluated, total, best)
+"""
+def reportTermsProgress(parts, nums, kz, eInf, total, progress):
+        if len(nums) == 1:
+                reportProgress([p[0] for p in parts], nums[0], kz, eInf, total, progress)
+        else:
+                progress(sum(len(c.modules) for p in parts for c in p), total, None)
+
+"""
+ Evaluates every candidate of the grid search, in this process or spread
+ over a process pool
 
  time - time values array
  tension - tension values array
+ table - relaxation times table
  kz - deformation ratio
  num - number of terms in Prony series
+ eInf - the given equilibrium module, or None to determinate it
+ workers - number of worker processes, 1 to search in this process,
+ None for one per core
+ threads - BLAS threads of each worker
+ stats - optional SearchStats
+ progress - optional function called as progress(evaluated, total, best)
+ after each block of candidates, see reportProgress
+ cancel - optional object with an is_set() method, e.g. threading.Event;
+ the search raises SearchCancelled once it is set
+ weights - optional sample weights array, see logTimeBins
+
+ Returns - a Candidates collection, in the grid search order
+"""
+def searchCandidates(time, tension, table, kz, num, eInf=None, workers=1, threads=None, stats=None,
+                     progress=None, cancel=None, weights=None):
+        return searchTermsCandidates(time, tension, table, kz, [num], eInf, workers, threads, stats,
+                                     progress, cancel, weights)[0]
+
+"""
+ Evaluates every candidate of the grid search for several numbers of terms
+ at once: the windows of every number of terms are taken from the same
+ relaxation times table, so its Gram index is built once and shared
+
+ nums - numbers of terms in Prony series
+ progress - optional function called as progress(evaluated, total, best)
+ after each block of candidates, see reportTermsProgress
+
+ The other arguments as in searchCandidates
+
+ Returns - a list of Candidates collections, in the grid search order, one
+ per number of terms
+"""
+def searchTermsCandidates(time, tension, table, kz, nums, eInf=None, workers=1, threads=None, stats=None,
+                          progress=None, cancel=None, weights=None):
+        if workers is None or workers > 1:
+                import parallelSearch as psr
+                return psr.evaluateTermsParallel(time, tension, table, kz, nums, eInf,
+                                                 workers, threads, stats, progress, cancel, weights)
+
+        if progress is None and cancel is None:
+                # inner products of every distinct relaxation time
+                with sst.stage(stats, 'assembly'):
+                        index = st.gramIndex(time, tension, table, weights=weights)
+
+                # evaluates all the candidates of each number of terms in a single batch
+                cands = []
+                for num in nums:
+                        rows, cols = candidatePositions(num, len(table))
+                        cands.append(evaluateCandidates(index, rows, cols, kz, num, eInf, stats))
+                return cands
+
+        # evaluates the candidates table row by table row, all the windows of
+        # a row at once, checking the cancel between blocks of samples
+        total = sum(len(candidatePositions(num, len(table))[0]) for num in nums)
+        parts = []
+        for r in np.arange(0, len(table), 1):
+                checkCancelled(cancel)
+                with sst.stage(stats, 'assembly'):
+                        index = st.gramIndex(time, tension, table[r:r+1],
+                                             callback=lambda: checkCancelled(cancel), weights=weights)
+                part = []
+                for num in nums:
+                        rr, cc = candidatePositions(num, 1)
+                        part.append(evaluateCandidates(index, rr, cc, kz, num, eInf, stats))
+                parts.append(part)
+
+                if progress is not None:
+                        reportTermsProgress(parts, nums, kz, eInf, total, progress)
+
+        return [mergeCandidates([p[i] for p in parts], num) for i, num in enumerate(nums)]
+
+"""
+ Evaluates every candidate of the grid search, in this process, with a
+ function giving several Candidates collections from each Gram index
+
+ time - time values array
+ tension - tension values array, or (specimens, samples) array
+ table - relaxation times table
+ num - number of terms in Prony series
+ evaluate - function called as evaluate(index, rows, cols), returning a list
+ of Candidates collections
+ stats - optional SearchStats
+ progress - optional function called as progress(evaluated, total, None)
+ after each table row, counting the candidates of a single collection
+ cancel - optional threading.Event, the search raises SearchCancelled once it is set
+ weights - optional sample weights array
+
+ Returns - a list of Candidates collections, in the grid search order
+"""
+def searchShared(time, tension, table, num, evaluate, stats=None, progress=None, cancel=None, weights=None):
+        rows, cols = candidatePositions(num, len(table))
+
+        if progress is None and cancel is None:
+                # inner products of every distinct relaxation time
+                with sst.stage(stats, 'assembly'):
+                        index = st.gramIndex(time, tension, table, weights=weights)
+
+                return evaluate(index, rows, cols)
+
+        # evaluates the candidates table row by table row, checking the cancel
+        # between blocks of samples
+        parts = []
+        for r in np.arange(0, len(table), 1):
+                checkCancelled(cancel)
+                with sst.stage(stats, 'assembly'):
+                        index = st.gramIndex(time, tension, table[r:r+1],
+                                             callback=lambda: checkCancelled(cancel), weights=weights)
+                rr, cc = candidatePositions(num, 1)
+                parts.append(evaluate(index, rr, cc))
+
+                if progress is not None:
+                        progress(sum(len(p[0].modules) for p in parts), len(rows), None)
+
+        return [mergeCandidates([p[j] for p in parts], num) for j in range(len(parts[0]))]
+
+"""
+ Evaluates every candidate of the grid search for several specimens sharing
+ the time array (evaluateSpecimens), in this process
+
+ tensions - (specimens, samples) tension values array
+ progress - as in searchShared
+
+ The other arguments as in searchCandidates
+
+ Returns - a list of Candidates collections, in the grid search order, one
+ per specimen
+"""
+def searchSpecimensCandidates(time, tensions, table, kz, num, eInf=None, stats=None,
+                              progress=None, cancel=None, weights=None):
+        return searchShared(time, tensions, table, num,
+                            lambda index, rows, cols: evaluateSpecimens(index, rows, cols, kz, num, eInf, stats),
+                            stats, progress, cancel, weights)
+
+"""
+ Evaluates every candidate of the grid search for several given equilibrium
+ modules (evaluateEinfs), in this process
+
+ eInfs - the given equilibrium modules
+ progress - as in searchShared
+
+ The other arguments as in searchCandidates
+
+ Returns - a list of Candidates collections, in the grid search order, one
+ per E_inf
+"""
+def searchEinfsCandidates(time, tension, table, kz, num, eInfs, stats=None,
+                          progress=None, cancel=None, weights=None):
+        return searchShared(time, tension, table, num,
+                            lambda index, rows, cols: evaluateEinfs(index, rows, cols, kz, num, eInfs, stats),
+                            stats, progress, cancel, weights)
+
+"""
+ Evaluates every candidate of the grid search for several deformation rates
+ (evaluateRates), in this process
+
+ kzs - deformation ratios
+ progress - as in searchShared
+
+ The other arguments as in searchCandidates
+
+ Returns - a list of Candidates collections, in the grid search order, one
+ per rate
+"""
+def searchRatesCandidates(time, tension, table, kzs, num, eInf=None, stats=None,
+                          progress=None, cancel=None, weights=None):
+        return searchShared(time, tension, table, num,
+                            lambda index, rows, cols: evaluateRates(index, rows, cols, kzs, num, eInf, stats),
+                            stats, progress, cancel, weights)
+
+# result of a search: the fitted constants and the selection scores only,
+# the candidates are kept by writeArchive on request
+Relaxation = col.namedtuple('Relaxation',
+                            ['relaxation_times',
+                             'modules',
+                             'equilibrium_module',
+                             'deformation_rate',
+                             'r_squared',
+                             'variation_coefficient'])
+
+"""
+ Builds the result of a relaxation times search
+
+ cand - a Candidates collection, in the grid search order
+ k - index of the selected candidate
+ kz - deformation ratio
+ num - number of terms in Prony series
+ eInf - the given equilibrium module, or None if it was determinated
+
+ Returns - a Relaxation collection
+"""
+def relaxationResult(cand, k, kz, num, eInf=None):
+        # copies, so the result does not keep the candidates arrays alive
+        eeopt = np.array(cand.modules[k])
+        pp = np.array(cand.relaxation_times[k])
+        rsq = float(cand.r_squared[k])
+        cov = float(cand.variation_coefficient[k])
+        if eInf is None:
+                return Relaxation(pp, eeopt[1:len(eeopt)], eeopt[0], kz, rsq, cov)
+
+        return Relaxation(pp, eeopt, eInf, kz, rsq, cov)
+
+"""
+ Writes the candidates of a search to a .npy archive, one record per
+ candidate in a (windows, mantissas) array, with the fields relaxation_times,
+ modules (E_inf first when it is determinated), singular, r_squared,
+ variation_coefficient, exponent_mean, exponent_inf and accepted. The
+ records are written to a memory map one exponent window at a time
+
+ fileName - .npy file
+ cand - a Candidates collection, in the grid search order
+ num - number of terms in Prony series
+ givenEinf - boolean, True if E_inf was given
+"""
+def writeArchive(fileName, cand, num, givenEinf):
+        nwin = windowCount(num)
+        fields = {'relaxation_times': cand.relaxation_times,
+                  'modules': cand.modules,
+                  'singular': cand.singular,
+                  'r_squared': cand.r_squared,
+                  'variation_coefficient': cand.variation_coefficient,
+                  'exponent_mean': cand.exponent_mean,
+                  'exponent_inf': cand.exponent_inf,
+                  'accepted': acceptedCandidates(cand, givenEinf)}
+        dtype = np.dtype([(name, np.asarray(v).dtype, np.shape(v)[1:]) for name, v in fields.items()])
+
+        archive = np.lib.format.open_memmap(fileName, mode='w+', dtype=dtype, shape=(nwin, len(cand.modules) // nwin))
+        try:
+                for w in np.arange(0, nwin, 1):
+                        rows = slice(w*archive.shape[1], (w+1)*archive.shape[1])
+                        for name, values in fields.items():
+                                archive[name][w] = values[rows]
+                archive.flush()
+        finally:
+                del archive
+
+"""
+ Opens a candidates archive of writeArchive without loading it
+
+ fileName - .npy file
+
+ Returns - a read only (windows, mantissas) numpy memory map of records
+"""
+def readArchive(fileName):
+        return np.load(fileName, mmap_mode='r')
+
+"""
+ Calculates the best relaxation times array for the given Prony series
+ number of terms, deformation rate and time and tension values array.
+ Iterates through the relaxation times array in the defined exponent range;
+ getRelaxationTimesRates fits several deformation rates.
+
+ time - time values array
+ tension - tension values array
+ kz - deformation ratio
+ num - number of terms in Prony series
+ step - mantissa step of the relaxation times
+ workers - number of worker processes, 1 to search in this process,
+ None for one per core
+ threads - BLAS threads of each worker, None to share the cores among the workers
+ stats - optional SearchStats collecting stage times, candidate counts and peak memory
+ progress - optional function called as progress(evaluated, total, best)
+ with the best result so far
+ cancel - optional threading.Event, the search raises SearchCancelled once it is set
+ weights - optional sample weights array, for the time bins of logTimeBins
+ archive - optional .npy file receiving every candidate (writeArchive)
  
- Returns - a collection
+ Returns - a Relaxation collection
 """
-def getRelaxationTimes(time, tension, kz, num, step):
+def getRelaxationTimes(time, tension, kz, num, step, workers=1, threads=None, stats=None,
+                       progress=None, cancel=None, weights=None, archive=None):
 
-        # initializes relaxation times array
-        # value range: 10e-6 to 10e10
-        # set the geomspace numpy array
-        # geomspace initial exponents
-        ini = -6    # lowest possible exponent
-        fin = 10    # highest possible exponent
+        with sst.run(stats):
+                table = relaxationTimesTable(step)
+                cand = searchCandidates(time, tension, table, kz, num, None, workers, threads, stats,
+                                        progress, cancel, weights)
+                if archive is not None:
+                        writeArchive(archive, cand, num, False)
+                k = selectCandidate(cand, False, stats)
 
-        # the 0-th exponent when the last exponent = 10
-        lastini = 11 - num
+        return relaxationResult(cand, k, kz, num)
 
-        # set pp mantissa values
-        # value range: 1.0 to 9.0 by 1
-        # e.g. 1E3, 2E3, 3E4...
-        ppmant = np.arange(1.0, 10.0, step=step)
+def getRelaxationTimesEinf(time, tension, eInf, kz, num, step, workers=1, threads=None, stats=None,
+                           progress=None, cancel=None, weights=None, archive=None):
 
-        # initializes ee array to keep Prony series constants values
-        ee = np.empty(shape=(num), dtype=float)
+        with sst.run(stats):
+                table = relaxationTimesTable(step)
+                cand = searchCandidates(time, tension, table, kz, num, eInf, workers, threads, stats,
+                                        progress, cancel, weights)
+                if archive is not None:
+                        writeArchive(archive, cand, num, True)
+                k = selectCandidate(cand, True, stats)
 
-        eeopt = np.zeros(num)   # array to keep the optimum array    
-        ecopt = 1               # variation coefficient as the minimum possible: 0
-        rsopt = 0               # r-squared optimum value
+        return relaxationResult(cand, k, kz, num, eInf)
 
-        # initializes matrix to keep the ee values
-        mtxe = np.empty(shape=((lastini-ini+1),len(ppmant),len(ee)+1))
+# best candidate of a number of terms in a search over several of them
+TermsFit = col.namedtuple('TermsFit', ['terms', 'result', 'residual'])
 
-        # loop through pp
-        for i in np.arange(0, (lastini-ini+1), 1):
-                
-                # i-th start and stop exponents from i-th geomspace array
-                start = ini + i
-                stop = (num - 1) + start
-
-                for j in np.arange(0, len(ppmant), 1):
-
-                        startValue = ppmant[j]*np.float(10)**(start)
-                        stopValue = ppmant[j]*np.float(10)**(stop)
-
-                        # i-th geomspace array
-                        # logaritmic decades
-                        pp = np.geomspace(startValue, stopValue, num)
-                        #print(pp)
-
-                        # set vector B
-                        vec = st.vectorB(tension, time, pp, num)
-
-                        # set matrix
-                        mtx = st.matrixA(kz, time, pp, num)
-
-                        # solve
-                        ee = st.solve(mtx, vec)
-
-                        # store ee j-th array in 3-dimensional matrix
-                        # each input in this matrix is a Prony series constant array
-                        # next step, obtain the best values by the stop criteria
-                        mtxe[i][j] = ee
-
-                        if not np.array_equal(ee, np.ones((len(ee),), dtype=int)):
-
-                                # check the variance and variance coefficient of the exponents
-                                # get the exponent array
-                                expvec = np.floor(np.log10(np.abs(ee[1:]))).astype(int)
-                                expstd = np.std(expvec)
-                                expmen = np.mean(expvec)
-                                expcov = expstd/expmen
-                                expinf = np.floor(np.log10(np.abs(ee[0]))).astype(int)
-
-                                # fits ee values to 3th degree polynomy
-                                print('pp:', pp)
-                                print('ee:',ee)
-                                reg = polynomialRegression(pp, abs(ee[1:]), 3)
-                                if(reg.r_squared > rsopt and reg.r_squared < 0.8 and
-                                   expcov < ecopt and expcov > 0.10 and
-                                   0.7*expmen <= expinf <= 1.3*expmen):  
-                                        rsopt = reg.r_squared
-                                        eeopt = ee
-                                        ppopt = pp
-                                        maopt = mtx
-                                        vbopt = vec
-                                        ecopt = expcov                        
-
-        Relaxation = col.namedtuple('Relaxation',
-                                    ['relaxation_times',
-                                     'modules',
-                                     'equilibrium_module',
-                                     'deformation_rate',
-                                     'matrixA',
-                                     'vectorB',
-                                     'all_modules'])
-        rr = Relaxation(ppopt, eeopt[1:len(eeopt)], eeopt[0], kz, maopt, vbopt, mtxe)
-
-        return rr
-
-def getRelaxationTimesEinf(time, tension, eInf, kz, num, step):
-
-        # initializes relaxation times array
-        # value range: 10e-6 to 10e10
-        # set the geomspace numpy array
-        # geomspace initial exponents
-        ini = -6    # lowest possible exponent
-        fin = 10    # highest possible exponent
-
-        # the 0-th exponent when the last exponent = 10
-        lastini = 11 - num
+"""
+ Calculates the best relaxation times array of several numbers of terms in
+ a single sweep of the relaxation times table (searchTermsCandidates), so
+ the number of terms can be chosen from their residuals
 
-        # set pp mantissa values
-        # value range: 1.0 to 9.0 by 1
-        # e.g. 1E3, 2E3, 3E4...
-        ppmant = np.arange(1.0, 10.0, step=step)
+ time - time values array
+ tension - tension values array
+ kz - deformation ratio
+ nums - numbers of terms in Prony series
+ step - mantissa step of the relaxation times
+ eInf - the given equilibrium module, or None to determinate it
+ workers, threads, stats, progress, cancel, weights - as in getRelaxationTimes,
+ progress as in reportTermsProgress
+
+ Returns - a list of TermsFit collections, one per number of terms: the
+ Relaxation collection of the selected candidate and its weighted residual
+ sum of squares, or None and an infinite residual when no candidate satisfies
+ the selection criteria
+"""
+def getRelaxationTimesTerms(time, tension, kz, nums, step, eInf=None, workers=1, threads=None, stats=None,
+                            progress=None, cancel=None, weights=None):
+        givenEinf = eInf is not None
+
+        with sst.run(stats):
+                table = relaxationTimesTable(step)
+                cands = searchTermsCandidates(time, tension, table, kz, nums, eInf, workers, threads, stats,
+                                              progress, cancel, weights)
+                fits = []
+                for num, cand in zip(nums, cands):
+                        try:
+                                k = selectCandidate(cand, givenEinf, stats)
+                        except ValueError:
+                                fits.append(TermsFit(num, None, np.inf))
+                                continue
+
+                        result = relaxationResult(cand, k, kz, num, eInf)
+                        with sst.stage(stats, 'selection'):
+                                rss = resultResidual(time, tension, result, num, weights)
+                        fits.append(TermsFit(num, result, rss))
+
+        return fits
 
-        # initializes ee array to keep Prony series constants values
-        ee = np.empty(shape=(num), dtype=float)
+"""
+ Calculates the best relaxation times array of several specimens tested with
+ the same time array and deformation rate, at about the cost of a single one
+ (searchSpecimensCandidates)
 
-        eeopt = np.zeros(num)   # array to keep the optimum array    
-        ecopt = 1               # variation coefficient as the minimum possible: 0
-        rsopt = 0               # r-squared optimum value
+ time - time values array
+ tensions - (specimens, samples) tension values array
+ kz - deformation ratio
+ num - number of terms in Prony series
+ step - mantissa step of the relaxation times
+ eInf - the given equilibrium module of every specimen, or None to determinate it
+ stats, cancel, weights - as in getRelaxationTimes
+ progress - as in searchSpecimensCandidates
 
-        # initializes matrix to keep the ee values
-        mtxe = np.empty(shape=((lastini-ini+1),len(ppmant),len(ee)))
+ Returns - a list of Relaxation collections, one per specimen, None for a
+ specimen without a candidate satisfying the selection criteria
+"""
+def getRelaxationTimesSpecimens(time, tensions, kz, num, step, eInf=None, stats=None,
+                                progress=None, cancel=None, weights=None):
+        with sst.run(stats):
+                table = relaxationTimesTable(step)
+                cands = searchSpecimensCandidates(time, tensions, table, kz, num, eInf, stats,
+                                                  progress, cancel, weights)
+                results = selectResults(cands, kz, num, [eInf]*len(cands), stats)
 
-        # loop through pp
-        for i in np.arange(0, (lastini-ini+1), 1):
-                
-                # i-th start and stop exponents from i-th geomspace array
-                start = ini + i
-                stop = (num - 1) + start
-
-                for j in np.arange(0, len(ppmant), 1):
-
-                        startValue = ppmant[j]*np.float(10)**(start)
-                        stopValue = ppmant[j]*np.float(10)**(stop)
-
-                        # i-th geomspace array
-                        # logaritmic decades
-                        pp = np.geomspace(startValue, stopValue, num)
-
-                        # set vector B
-                        vec = st.vectorBred(tension, time, pp, eInf, kz, num)
-            
-                        # set matrix
-                        mtx = st.matrixAred(kz, time, pp, num)
-
-                        # solve
-                        ee = st.solve(mtx, vec)
-
-                        # store ee j-th array in 3-dimensional matrix
-                        # each input in this matrix is a Prony series constant array
-                        # next step, obtain the best values by the stop criteria
-                        mtxe[i][j] = ee
-
-                        if not np.array_equal(ee, np.ones((len(ee),), dtype=int)):
-
-                                # check the variance and variance coefficient of the exponents
-                                # get the exponent array
-                                expvec = np.floor(np.log10(np.abs(ee))).astype(int)
-                                expstd = np.std(expvec)
-                                expmen = np.mean(expvec)
-                                expcov = expstd/expmen
-                                expinf = np.floor(np.log10(np.abs(eInf))).astype(int)
-
-                                # fits ee values to 3th degree polynomy
-                                print('pp:', pp)
-                                print('ee:',ee)
-                                reg = polynomialRegression(pp, abs(ee), 3)
-                                if(0.7*expmen <= expinf <= 1.5*expmen):   
-                                        rsopt = reg.r_squared
-                                        eeopt = ee
-                                        ppopt = pp
-                                        maopt = mtx
-                                        vbopt = vec
-                                        ecopt = expcov
-
-        Relaxation = col.namedtuple('Relaxation',
-                                    ['relaxation_times',
-                                     'modules',
-                                     'equilibrium_module',
-                                     'deformation_rate',
-                                     'matrixA',
-                                     'vectorB',
-                                     'all_modules'])
-        rr = Relaxation(ppopt, eeopt, eInf, kz, maopt, vbopt, mtxe)
-
-        return rr
+        return results
+
+"""
+ Calculates the best relaxation times array for each of several given
+ equilibrium modules, at about the cost of a single one
+ (searchEinfsCandidates): the selection of getRelaxationTimesEinf is applied
+ to the candidates of each E_inf
+
+ time - time values array
+ tension - tension values array
+ eInfs - the given equilibrium modules
+ kz - deformation ratio
+ num - number of terms in Prony series
+ step - mantissa step of the relaxation times
+ stats, cancel, weights - as in getRelaxationTimes
+ progress - as in searchShared
+
+ Returns - a list of Relaxation collections, one per E_inf, None for an
+ E_inf without a candidate satisfying the selection criteria
+"""
+def getRelaxationTimesEinfSweep(time, tension, eInfs, kz, num, step, stats=None,
+                                progress=None, cancel=None, weights=None):
+        eInfs = [float(eInf) for eInf in eInfs]
+
+        with sst.run(stats):
+                table = relaxationTimesTable(step)
+                cands = searchEinfsCandidates(time, tension, table, kz, num, eInfs, stats,
+                                              progress, cancel, weights)
+                results = selectResults(cands, kz, num, eInfs, stats)
+
+        return results
+
+# best candidate of a deformation rate in a search over several of them
+RateFit = col.namedtuple('RateFit', ['rate', 'result', 'residual'])
+
+"""
+ Calculates the best relaxation times array for each of several deformation
+ rates, solving each candidate system once (searchRatesCandidates), so the
+ rate can be chosen from their residuals. Without E_inf the fitted tension
+ does not depend on the rate, only the modules scale with 1/kz, so the
+ residuals differ only where the selection differs. Each rate matches a
+ single fit at that rate up to the round-off described in evaluateRates
+
+ time - time values array
+ tension - tension values array
+ kzs - deformation ratios
+ num - number of terms in Prony series
+ step - mantissa step of the relaxation times
+ eInf - the given equilibrium module, or None to determinate it
+ stats, cancel, weights - as in getRelaxationTimes
+ progress - as in searchShared
+
+ Returns - a list of RateFit collections, one per rate: the Relaxation
+ collection of the selected candidate and its weighted residual sum of
+ squares, or None and an infinite residual when no candidate satisfies the
+ selection criteria
+"""
+def getRelaxationTimesRates(time, tension, kzs, num, step, eInf=None, stats=None,
+                            progress=None, cancel=None, weights=None):
+        kzs = [float(kz) for kz in kzs]
+        givenEinf = eInf is not None
+
+        with sst.run(stats):
+                table = relaxationTimesTable(step)
+                cands = searchRatesCandidates(time, tension, table, kzs, num, eInf, stats,
+                                              progress, cancel, weights)
+                fits = []
+                for kz, cand in zip(kzs, cands):
+                        try:
+                                k = selectCandidate(cand, givenEinf, stats)
+                        except ValueError:
+                                fits.append(RateFit(kz, None, np.inf))
+                                continue
+
+                        result = relaxationResult(cand, k, kz, num, eInf)
+                        with sst.stage(stats, 'selection'):
+                                rss = resultResidual(time, tension, result, num, weights)
+                        fits.append(RateFit(kz, result, rss))
+
+        return fits
+
+"""
+ Selects the best candidate of each of several Candidates collections
+
+ cands - list of Candidates collections, in the grid search order
+ kz - deformation ratio
+ num - number of terms in Prony series
+ eInfs - the given equilibrium module of each collection, or None where it
+ was determinated
+ stats - optional SearchStats
+
+ Returns - a list of Relaxation collections, None for a collection without
+ a candidate satisfying the selection criteria
+"""
+def selectResults(cands, kz, num, eInfs, stats=None):
+        results = []
+        for cand, eInf in zip(cands, eInfs):
+                try:
+                        k = selectCandidate(cand, eInf is not None, stats)
+                except ValueError:
+                        results.append(None)
+                        continue
+                results.append(relaxationResult(cand, k, kz, num, eInf))
+
+        return results
 
 """
  Fit the prony series modules to a model by 3th degre polynomial regression
@@ -351,14 +1335,46 @@ def polynomialRegression(xx, yy, degree):
  return - R-Square value
 """
 def rsquared(yy, ff):
-    ssres=0
-    sstot=0
-    for i in range(len(yy)):
-        ssres = ssres + (yy[i] - ff[i])**2
-        sstot = sstot + (yy[i] - np.mean(yy))**2
+        yy = np.asarray(yy, dtype=float)
+        ssres = np.sum((yy - ff)**2)
+        sstot = np.sum((yy - np.mean(yy))**2)
 
-    rsq = 1-(ssres/sstot)
-    return rsq
+        return 1 - ssres/sstot
+
+"""
+ Builds the residual matrix of the polynomial regression on num equally
+ spaced x values: the residuals of y are y @ R, R = I - Q Q^T, with Q an
+ orthonormal basis of the polynomials. The R-Squared does not change under
+ an affine map of x, so R serves every relaxation times array of the grid,
+ whose log(p) are equally spaced by log(10)
+
+ num - number of points
+ degree - polynomial degree
+
+ Returns - a (num, num) numpy float array
+"""
+def regressionResidual(num, degree):
+        # centered x keeps the Vandermonde matrix well conditioned
+        xk = np.arange(0, num, 1) - (num - 1)/2
+        qq, _ = np.linalg.qr(np.vander(xk, degree + 1))
+
+        return np.eye(num) - qq @ qq.T
+
+"""
+ Computes the R-Squared of the polynomial regression of a batch of arrays
+ at once, as polynomialRegression(p, y, degree).r_squared for relaxation
+ times equally spaced on the log scale
+
+ yy - (candidates, num) observed values (prony series modules)
+ residual - residual matrix (regressionResidual)
+
+ Returns - a (candidates) numpy float array
+"""
+def rsquaredBatch(yy, residual):
+        ssres = np.sum((yy @ residual)**2, axis=1)
+        sstot = np.sum((yy - np.mean(yy, axis=1, keepdims=True))**2, axis=1)
+
+        return 1 - ssres/sstot
 
 """
  Check if the model is well adjusted
@@ -387,28 +1403,315 @@ def isAllPositiveArray(array):
         return test
 
 """
- Reads a csv file with two columns. It must be p and E respectively and
- must not have the columns header in the file
+ Tests if a csv line holds only numeric fields. Used to detect the columns
+ header rows
+
+ line - a csv line
+
+ Returns - a boolean
+"""
+def isNumericRow(line):
+        try:
+                for field in line.split(','):
+                        float(field)
+        except ValueError:
+                return False
+
+        return True
+
+"""
+ Reads a csv file with numeric columns straight into float arrays. The file
+ is parsed in large blocks of lines and the leading rows that are not
+ numeric (columns header) are skipped
+
+ fileName - file name within the .csv extension
+ chunk - approximate size in bytes of each block of lines
+
+ Returns - a (columns, rows) numpy float array, each column contiguous
+"""
+def readCSVArray(fileName, chunk=1 << 24):
+        blocks = []
+        with open(fileName) as csvFile:
+                # ignores columns header
+                line = csvFile.readline()
+                while line and not isNumericRow(line):
+                        line = csvFile.readline()
+
+                lines = [line] + csvFile.readlines(chunk) if line else []
+                while lines:
+                        # a block of blank lines only, e.g. at the end of the file
+                        if any(l.strip() for l in lines):
+                                blocks.append(np.loadtxt(lines, delimiter=',', dtype=float, ndmin=2))
+                        lines = csvFile.readlines(chunk)
+
+        if len(blocks) == 0:
+                raise ValueError('{}: no numeric rows'.format(fileName))
+
+        return np.ascontiguousarray(np.concatenate(blocks).T)
+
+"""
+ Reads a csv file with two columns. It must be p and E respectively;
+ the columns header, if any, is ignored
 
  Filename - file name within the .csv extension
  
  Returns - a 2d array with p and E columns respectively
 """
 def readCSV(fileName):
-        with open(fileName) as csvFile:
-                reader = csv.reader(csvFile, delimiter = ',')
-                cstE = []
-                cstP = []
-                results = []
-                for i in reader:
-                        results.append(i)
-                        # ignores column name
-                        cstP.append(i[0])
-                        cstE.append(i[1])
-                        
-        csvFile.close()
-        
-        return [cstP, cstE]
+        data = readCSVArray(fileName)
+        if len(data) < 2:
+                raise ValueError('{}: expected two columns'.format(fileName))
+
+        return [data[0], data[1]]
+
+"""
+ Reads a csv file of specimens tested with the same time values: the time
+ column followed by the tension column of each specimen; the columns
+ header, if any, is ignored
+
+ fileName - file name within the .csv extension
+
+ Returns - a list with the time array and the tension array of each specimen
+"""
+def readCSVSpecimens(fileName):
+        data = readCSVArray(fileName)
+        if len(data) < 2:
+                raise ValueError('{}: expected two columns'.format(fileName))
+
+        return list(data)
+
+"""
+ Checks a creep test output: the time must be free of NaN values and must not
+ decrease, and the tension must be free of NaN values
+
+ time - time values array
+ tension - tension values array
+
+ Raises - ValueError if the test output is not valid
+"""
+def checkTestOutput(time, tension):
+        if len(time) != len(tension):
+                raise ValueError('time and tension have different lengths')
+
+        if np.isnan(time).any():
+                raise ValueError('time has NaN values at row {}'.format(np.flatnonzero(np.isnan(time))[0]+1))
+
+        if np.isnan(tension).any():
+                raise ValueError('tension has NaN values at row {}'.format(np.flatnonzero(np.isnan(tension))[0]+1))
+
+        dt = np.diff(time)
+        if (dt < 0).any():
+                raise ValueError('time is not monotonic at row {}'.format(np.flatnonzero(dt < 0)[0]+2))
+
+"""
+ Decimates a test output into log-spaced time bins. Each bin is replaced by
+ the mean time and tension of its samples, with the number of samples as its
+ weight, so the weighted fit of the bins approximates the fit of every sample.
+ The Prony basis varies on a log-time scale, so a few hundred bins keep almost
+ all the information of a test sampled uniformly in time
+
+ time - time values array, not decreasing (checkTestOutput)
+ tension - tension values array, or a (specimens, samples) array
+ bins - number of bins between the first positive time and the last time;
+ times not greater than zero fall in the first bin
+
+ Returns - a tuple containing the time, tension and weights arrays of the non-empty bins
+"""
+def logTimeBins(time, tension, bins):
+        tt = np.asarray(time, dtype=float)
+        ss = np.asarray(tension, dtype=float)
+        if bins < 1:
+                raise ValueError('the number of bins must be positive')
+
+        positive = tt[tt > 0]
+        if len(positive) == 0:
+                raise ValueError('time has no positive values')
+
+        edges = np.geomspace(positive[0], tt[-1], bins+1)
+        idx = np.clip(np.searchsorted(edges, tt, side='right') - 1, 0, bins-1)
+
+        ww = np.bincount(idx, minlength=bins).astype(float)
+        keep = ww > 0
+        tb = np.bincount(idx, weights=tt, minlength=bins)[keep]/ww[keep]
+        sums = [np.bincount(idx, weights=s, minlength=bins)[keep]/ww[keep] for s in np.atleast_2d(ss)]
+        sb = sums[0] if ss.ndim == 1 else np.stack(sums)
+
+        return (tb, sb, ww[keep])
+
+"""
+ Selects the points of a curve to draw in an x range with a given number of
+ columns (pixels): the first and the last point and the minimum and the
+ maximum of each column, so the peaks stay visible while the number of
+ points does not depend on the size of the curve
+
+ xx - x values array, not decreasing
+ yy - y values array, free of NaN values
+ lo, hi - x range
+ bins - number of columns
+
+ Returns - the sorted int array of the selected positions, with one point
+ beyond each side of the range so the line reaches its edges
+"""
+def decimationIndex(xx, yy, lo, hi, bins):
+        xx = np.asarray(xx)
+        yy = np.asarray(yy)
+
+        i0 = max(int(np.searchsorted(xx, lo, 'left')) - 1, 0)
+        i1 = min(int(np.searchsorted(xx, hi, 'right')) + 1, len(xx))
+        if i1 - i0 <= 4*bins:
+                return np.arange(i0, i1)
+
+        # the points of a column are contiguous: the start of each non-empty one
+        seg = yy[i0:i1]
+        edges = np.searchsorted(xx[i0:i1], np.linspace(lo, hi, bins + 1)[1:-1])
+        starts = np.unique(np.concatenate(([0], edges)))
+        starts = starts[starts < len(seg)]
+        counts = np.diff(np.append(starts, len(seg)))
+
+        # first position of the extreme of each column
+        picks = [np.arange(0, 1), np.arange(len(seg) - 1, len(seg))]
+        for extreme in (np.minimum, np.maximum):
+                hit = np.flatnonzero(seg == np.repeat(extreme.reduceat(seg, starts), counts))
+                picks.append(hit[np.searchsorted(hit, starts)])
+
+        return i0 + np.unique(np.concatenate(picks))
+
+"""
+ Evaluates the tension of a relaxation times search result
+
+ time - time array
+ result - collection returned by getRelaxationTimes or getRelaxationTimesEinf
+ num - number of terms in Prony series
+
+ Returns - array with values of tension
+"""
+def resultTension(time, result, num):
+        return tension(time, result.deformation_rate, result.equilibrium_module,
+                       result.modules, result.relaxation_times, num)
+
+"""
+ Evaluates the weighted residual sum of squares of a relaxation times search
+ result from its tension, sum(w*(s - tension)^2)
+
+ time - time array
+ tension - tension array
+ result - Relaxation collection
+ num - number of terms in Prony series
+ weights - optional sample weights array
+
+ Returns - a float
+"""
+def resultResidual(time, tension, result, num, weights=None):
+        rr = np.asarray(tension, dtype=float) - resultTension(time, result, num)
+
+        return float(rr @ st.weightedTension(rr, weights))
+
+Decimation = col.namedtuple('Decimation',
+                            ['bins',
+                             'samples',
+                             'full_seconds',
+                             'decimated_seconds',
+                             'speedup',
+                             'same_relaxation_times',
+                             'equilibrium_module_error',
+                             'modules_error',
+                             'tension_error'])
+
+"""
+ Fits a test output with every sample and with its log-time bins and
+ compares the results, to choose a number of bins. The errors are relative:
+ E_inf error |dE_inf|/|E_inf|, modules error ||dE||/||E|| (term by term,
+ even when the relaxation times differ) and tension error the RMS of the
+ difference of the fitted tensions over the RMS of the full fit tension,
+ both evaluated at every test time
+
+ time - time values array
+ tension - tension values array
+ kz - deformation ratio
+ num - number of terms in Prony series
+ step - mantissa step of the relaxation times
+ bins - number of bins (logTimeBins)
+ eInf - the given equilibrium module, or None to determinate it
+ workers, threads - as in getRelaxationTimes
+
+ Returns - a Decimation collection
+"""
+def compareDecimation(time, tension, kz, num, step, bins, eInf=None, workers=1, threads=None):
+        def fit(tt, ss, ww):
+                if eInf is None:
+                        return getRelaxationTimes(tt, ss, kz, num, step, workers, threads, weights=ww)
+                return getRelaxationTimesEinf(tt, ss, eInf, kz, num, step, workers, threads, weights=ww)
+
+        start = perf_counter()
+        full = fit(time, tension, None)
+        middle = perf_counter()
+        dec = fit(*logTimeBins(time, tension, bins))
+        end = perf_counter()
+
+        sf = resultTension(time, full, num)
+        sd = resultTension(time, dec, num)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+                return Decimation(bins, len(time), middle - start, end - middle, (middle - start)/(end - middle),
+                                  bool(np.array_equal(full.relaxation_times, dec.relaxation_times)),
+                                  abs(dec.equilibrium_module - full.equilibrium_module)/abs(full.equilibrium_module),
+                                  np.linalg.norm(dec.modules - full.modules)/np.linalg.norm(full.modules),
+                                  np.sqrt(np.mean((sd - sf)**2)/np.mean(sf**2)))
+
+"""
+ Formats the rows of a block as csv lines: a single format string for the
+ whole block, instead of a format call per row as np.savetxt
+
+ block - (rows, columns) numpy float array
+ fmt - number format
+
+ Returns - the csv text of the block
+"""
+def formatCSV(block, fmt=CSV_FORMAT):
+        line = ','.join([fmt]*block.shape[1]) + '\n'
+
+        return (line*block.shape[0]) % tuple(block.ravel().tolist())
+
+"""
+ Writes columns of values to a csv file by blocks of rows, so the memory
+ does not grow with the number of rows
+
+ fileName - csv file name
+ columns - list of equal length value arrays
+ chunk - number of rows formatted at once
+
+ Returns - the number of rows written
+"""
+def writeCSV(fileName, columns, chunk=65536):
+        columns = [np.asarray(c, dtype=float) for c in columns]
+        rows = len(columns[0])
+        with open(fileName, 'w', buffering=1 << 20) as csvFile:
+                for i in np.arange(0, rows, chunk):
+                        csvFile.write(formatCSV(np.column_stack([c[i:i+chunk] for c in columns])))
+
+        return rows
+
+"""
+ Writes columns of values to a file, in the format of its extension: .npy,
+ a (rows, columns) array; .npz, an array per column, by their names; any
+ other, csv (writeCSV)
+
+ fileName - output file name
+ names - column names
+ columns - list of equal length value arrays
+
+ Returns - the number of rows written
+"""
+def writeColumns(fileName, names, columns):
+        ext = os.path.splitext(fileName)[1].lower()
+        if ext == '.npz':
+                np.savez(fileName, **{name: np.asarray(c, dtype=float) for name, c in zip(names, columns)})
+        elif ext == '.npy':
+                np.save(fileName, np.column_stack([np.asarray(c, dtype=float) for c in columns]))
+        else:
+                return writeCSV(fileName, columns)
+
+        return len(columns[0])
 
 """ 
  Writes a txt file with a table in LaTeX.
@@ -420,7 +1723,6 @@ def readCSV(fileName):
  
 """
 def writeTexTable(fileName, table, e_inf, k_z):
-        print('OOOOOOOOOOOOOOOOOOOOOOOOOO')
         with open(fileName, 'w') as textFile:
                 textFile.write('\\begin{table}[htb] \n')
                 textFile.write('\t \\centering \n')
@@ -457,13 +1759,7 @@ def writeTexTable(fileName, table, e_inf, k_z):
  
  a - a string array
  
- Returns - a float array
+ Returns - a contiguous numpy float array, no copy if a already is one
 """
 def toFloatArray(a):
-        f = []  
-        i = 0
-        while i < len(a):
-                f.append(float(a[i]))
-                i = i+1
-        
-        return f
\ No newline at end of file
+        return np.ascontiguousarray(a, dtype=float)
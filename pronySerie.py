@@ -1,11 +1,78 @@
+import numpy as np
+
 import prony as pr
-import matplotlib.pyplot as plt
+import searchStats as sst
+import continuousSearch as cs
+import adaptiveSearch as ads
 
 class PronySerie:
 
-    def setTestOutput(self, output):
-        self.time = pr.toFloatArray(output[0])
-        self.tension = pr.toFloatArray(output[1])
+    # relaxation search in this process by default
+    workers = 1
+    threads = None
+
+    # relaxation search instrumentation, off by default
+    stats = None
+
+    # relaxation search on every sample by default
+    bins = None
+
+    # relaxation search mode: 'grid' (relaxation times table with the step),
+    # 'continuous' (variable projection from a coarse grid) or 'adaptive'
+    # (mantissas refined from coarse to fine)
+    search = 'grid'
+
+    # relaxation search results cache (fitCache.FitCache), off by default;
+    # cached is True when the last results were read from it
+    cache = None
+    cached = False
+
+    # numbers of terms fitted in a single grid search sweep by runRelaxation,
+    # None to fit only the number of terms set; termsFits holds the
+    # prony.TermsFit of each one after the sweep
+    sweep = None
+    termsFits = None
+
+    # deformation rates fitted in a single grid search by runRelaxation, None
+    # to fit only the rate set; rateFits holds the prony.RateFit of each one
+    # after the sweep
+    rates = None
+    rateFits = None
+
+    # optional .npy file receiving every candidate of the relaxation search
+    # (prony.writeArchive); the search always runs when it is set
+    archive = None
+
+    # tension of each specimen, a (specimens, samples) array, when the test
+    # output has several tension arrays, else None; specimenResults holds the
+    # result of each specimen, None for a specimen without result, and
+    # specimen is the one in tension and results
+    tensions = None
+    specimenResults = None
+    specimen = 0
+
+    # time grid of the test simulation, a tuple of the prony.simulationTimes
+    # arguments (grid, duration, readings, times, first), None to simulate on
+    # the time set
+    grid = None
+
+    # test time and tension arrays, checked before use; further tension
+    # arrays are other specimens tested with the same time array, all of
+    # them are fitted together by runRelaxation
+    # bins - optional number of log-spaced time bins the relaxation search
+    # fits instead of every sample (prony.logTimeBins)
+    def setTestOutput(self, output, bins=None):
+        time = pr.toFloatArray(output[0])
+        tensions = [pr.toFloatArray(tension) for tension in output[1:]]
+        for tension in tensions:
+            pr.checkTestOutput(time, tension)
+
+        self.time = time
+        self.tension = tensions[0]
+        self.tensions = np.vstack(tensions) if len(tensions) > 1 else None
+        self.specimenResults = None
+        self.specimen = 0
+        self.bins = bins
 
     # test time
     def setTime(self, time):
@@ -35,27 +102,260 @@ class PronySerie:
     def setStep(self, step):
         self.step = step
 
+    # relaxation search mode, 'grid', 'continuous' or 'adaptive'
+    def setSearch(self, search):
+        self.search = search
+
+    # relaxation search worker processes (None for one per core)
+    # and BLAS threads of each worker (None to share the cores)
+    def setWorkers(self, workers, threads=None):
+        self.workers = workers
+        self.threads = threads
+
+    # relaxation search results cache, a fitCache.FitCache or None
+    def setCache(self, cache):
+        self.cache = cache
+
+    # numbers of terms of the sweep, or None
+    def setTermsSweep(self, nums):
+        self.sweep = nums
+
+    # deformation rates of the sweep, or None
+    def setRateSweep(self, rates):
+        self.rates = rates
+
+    # candidates archive of the relaxation search, a .npy file name or None
+    def setArchive(self, archive):
+        self.archive = archive
+
+    # relaxation search instrumentation: stage times, candidate counts, the
+    # peak memory of the search with traceMemory and the lifetime peak
+    # resident memory of the process, read from self.stats.report() after runRelaxation
+    def setInstrumentation(self, bo, traceMemory=False):
+        self.stats = sst.SearchStats(traceMemory) if bo else None
+
+    # time grid of the test simulation: 'linear' or 'log' with the duration
+    # and the number of readings, or 'array' with the times
+    # first - first time after 0 of the log grid (prony.logTimes)
+    def setSimulationGrid(self, grid, duration=None, readings=None, times=None, first=None):
+        self.grid = (grid, duration, readings, times, first)
+
     # set prony serie characterization to test simulation
     def setSimulationInput(self, simulation):
         self.relaxatioTimes = pr.toFloatArray(simulation[0])
         self.modules = pr.toFloatArray(simulation[1])
 
     # get optimum relaxation times
-    def runRelaxation(self):
-        if self.einfType == True:
-            self.results = pr.getRelaxationTimesEinf(self.time,
-                                                     self.tension,
+    # progress(evaluated, total, best) is called with the best result so far;
+    # the search raises prony.SearchCancelled once cancel (threading.Event) is set
+    # with a cache, the results of the same test and parameters are read back
+    def runRelaxation(self, progress=None, cancel=None):
+        self.cached = False
+        if self.tensions is not None:
+            if self.sweep is not None or self.rates is not None:
+                raise ValueError('the terms and rate sweeps fit a single specimen')
+            self.searchSpecimens(progress, cancel)
+            return
+
+        if self.rates is not None:
+            if self.sweep is not None:
+                raise ValueError('the rate sweep fits a single number of terms')
+            self.searchRates(progress, cancel)
+            return
+
+        if self.sweep is not None:
+            self.searchTerms(progress, cancel)
+            return
+
+        if self.cache is None or self.archive is not None:
+            self.searchRelaxation(progress, cancel)
+            return
+
+        key = self.cache.key(self.time, self.tension, self.searchParameters())
+        results = self.cache.get(key)
+        if results is None:
+            self.searchRelaxation(progress, cancel)
+            self.cache.put(key, self.results)
+        else:
+            self.results = results
+            self.cached = True
+            if progress is not None:
+                progress(1, 1, results)
+
+    # the parameters that determine the relaxation search results
+    def searchParameters(self):
+        return {'search': self.search,
+                'terms': int(self.num),
+                'rate': float(self.kk),
+                'step': float(self.step) if self.search == 'grid' else None,
+                'einf': float(self.givenEinf) if self.einfType == True else None,
+                'bins': None if self.bins is None else int(self.bins)}
+
+    # runs the relaxation search on the test output
+    def searchRelaxation(self, progress=None, cancel=None):
+        if self.stats is not None:
+            self.stats.reset()
+
+        time, tension, weights = self.fitData()
+
+        if self.search == 'continuous':
+            self.results = cs.getRelaxationTimesContinuous(time,
+                                                           tension,
+                                                           self.kk,
+                                                           self.num,
+                                                           self.givenEinf if self.einfType == True else None,
+                                                           self.workers,
+                                                           self.threads,
+                                                           self.stats,
+                                                           progress,
+                                                           cancel,
+                                                           weights,
+                                                           archive=self.archive)
+
+        elif self.search == 'adaptive':
+            self.results = ads.getRelaxationTimesAdaptive(time,
+                                                          tension,
+                                                          self.kk,
+                                                          self.num,
+                                                          self.givenEinf if self.einfType == True else None,
+                                                          self.workers,
+                                                          self.threads,
+                                                          self.stats,
+                                                          progress,
+                                                          cancel,
+                                                          weights,
+                                                          archive=self.archive)
+
+        elif self.einfType == True:
+            self.results = pr.getRelaxationTimesEinf(time,
+                                                     tension,
                                                      self.givenEinf,
                                                      self.kk,
                                                      self.num,
-                                                     self.step)
+                                                     self.step,
+                                                     self.workers,
+                                                     self.threads,
+                                                     self.stats,
+                                                     progress,
+                                                     cancel,
+                                                     weights,
+                                                     self.archive)
 
         else:
-            self.results = pr.getRelaxationTimes(self.time,
-                                                 self.tension,                                                 
+            self.results = pr.getRelaxationTimes(time,
+                                                 tension,
                                                  self.kk,
                                                  self.num,
-                                                 self.step)
+                                                 self.step,
+                                                 self.workers,
+                                                 self.threads,
+                                                 self.stats,
+                                                 progress,
+                                                 cancel,
+                                                 weights,
+                                                 self.archive)
+
+    # runs the grid search for every number of terms of the sweep and keeps
+    # the one of smallest residual; selectTerms takes another one
+    def searchTerms(self, progress=None, cancel=None):
+        if self.stats is not None:
+            self.stats.reset()
+
+        time, tension, weights = self.fitData()
+        self.termsFits = pr.getRelaxationTimesTerms(time,
+                                                    tension,
+                                                    self.kk,
+                                                    self.sweep,
+                                                    self.step,
+                                                    self.givenEinf if self.einfType == True else None,
+                                                    self.workers,
+                                                    self.threads,
+                                                    self.stats,
+                                                    progress,
+                                                    cancel,
+                                                    weights)
+
+        fitted = [f for f in self.termsFits if f.result is not None]
+        if len(fitted) == 0:
+            raise ValueError('no relaxation times satisfy the selection criteria')
+        self.selectTerms(min(fitted, key=lambda f: f.residual).terms)
+
+    # takes the result of a number of terms of the last sweep
+    def selectTerms(self, num):
+        fit = next(f for f in self.termsFits if f.terms == num)
+        self.num = num
+        self.results = fit.result
+
+    # runs the grid search for every deformation rate of the sweep, solving
+    # each candidate system once, and keeps the one of smallest residual;
+    # selectRate takes another one
+    def searchRates(self, progress=None, cancel=None):
+        if self.stats is not None:
+            self.stats.reset()
+
+        time, tension, weights = self.fitData()
+        self.rateFits = pr.getRelaxationTimesRates(time,
+                                                   tension,
+                                                   self.rates,
+                                                   self.num,
+                                                   self.step,
+                                                   self.givenEinf if self.einfType == True else None,
+                                                   self.stats,
+                                                   progress,
+                                                   cancel,
+                                                   weights)
+
+        fitted = [f for f in self.rateFits if f.result is not None]
+        if len(fitted) == 0:
+            raise ValueError('no relaxation times satisfy the selection criteria')
+        self.selectRate(min(fitted, key=lambda f: f.residual).rate)
+
+    # takes the result of a deformation rate of the last sweep
+    def selectRate(self, kk):
+        fit = next(f for f in self.rateFits if f.rate == kk)
+        self.kk = kk
+        self.results = fit.result
+
+    # runs the grid search of every specimen at once, sharing the systems
+    # factorizations (prony.getRelaxationTimesSpecimens)
+    def searchSpecimens(self, progress=None, cancel=None):
+        if self.stats is not None:
+            self.stats.reset()
+
+        time, tensions, weights = self.fitData(self.tensions)
+        self.specimenResults = pr.getRelaxationTimesSpecimens(time,
+                                                              tensions,
+                                                              self.kk,
+                                                              self.num,
+                                                              self.step,
+                                                              self.givenEinf if self.einfType == True else None,
+                                                              self.stats,
+                                                              progress,
+                                                              cancel,
+                                                              weights)
+
+        if all(r is None for r in self.specimenResults):
+            raise ValueError('no relaxation times satisfy the selection criteria')
+        self.selectSpecimen(self.specimen)
+
+    # takes the tension and the result of a specimen
+    def selectSpecimen(self, j):
+        self.specimen = j
+        self.tension = self.tensions[j]
+        if self.specimenResults is not None:
+            self.results = self.specimenResults[j]
+
+    # time, tension and weights arrays fitted by the relaxation search:
+    # the log-time bins of the test output, or every sample with no weights
+    # tension - the tension array, or arrays, to fit instead of self.tension
+    def fitData(self, tension=None):
+        if tension is None:
+            tension = self.tension
+        if self.bins is None:
+            return (self.time, tension, None)
+
+        return pr.logTimeBins(self.time, tension, self.bins)
+
     # get prony serie characterization
     def runPronySerie(self):
         self.prony = pr.prony(self.time,
@@ -66,10 +366,37 @@ class PronySerie:
 
     # get tension from test simulation
     def runSimulation(self):
+        if self.grid is not None:
+            output = np.concatenate(list(self.simulationChunks()), axis=1)
+            self.setTime(output[0])
+            self.setTension(output[1])
+            return
+
         tension = pr.tension(self.time,
                              self.kk,
                              self.givenEinf,
                              self.modules,
                              self.relaxatioTimes,
                              self.num)
-        self.setTension(tension)
\ No newline at end of file
+        self.setTension(tension)
+
+    # test simulation by blocks of chunk times, on the simulation grid or the
+    # time set: a generator of (2, block) arrays of the times and tensions
+    def simulationChunks(self, chunk=65536):
+        if self.grid is None:
+            times = pr.arrayTimes(self.time, chunk)
+        else:
+            grid, duration, readings, times, first = self.grid
+            times = pr.simulationTimes(grid, duration, readings, times, first, chunk)
+
+        return pr.simulationChunks(times,
+                                   self.kk,
+                                   self.givenEinf,
+                                   self.modules,
+                                   self.relaxatioTimes,
+                                   self.num)
+
+    # writes the test simulation to a csv file block by block, so the memory
+    # does not grow with the number of readings; returns the rows written
+    def writeSimulation(self, fileName, chunk=65536):
+        return pr.writeSimulation(fileName, self.simulationChunks(chunk))
\ No newline at end of file
@@ -0,0 +1,137 @@
+# Instrumentation of the relaxation times search
+#
+# A SearchStats object collects the wall time of each stage of the search
+# (assembly, solve, regression, selection and the optimization of the
+# continuous search), the number of candidates evaluated and rejected by each
+# criterion, the optimizer solves and the peak memory: the peak of the search
+# itself when traced by tracemalloc, and the peak resident memory of the
+# process, a high-water mark over its whole lifetime, so in a long running
+# process (the GUI) it is the largest peak of any earlier work. The search functions
+# take it as an optional argument; with None, each hook is a shared no-op
+# context, so the instrumentation costs nothing when it is off.
+
+import time
+import contextlib
+import tracemalloc
+
+# stages of the search, in execution order
+STAGES = ['assembly', 'solve', 'regression', 'selection', 'optimization']
+
+# candidate counters
+COUNTERS = ['evaluated',
+            'singular',
+            'rejected_r_squared',
+            'rejected_variation',
+            'rejected_exponent',
+            'accepted',
+            'optimizer_solves']
+
+_NULL = contextlib.nullcontext()
+
+class SearchStats:
+
+    '''
+     traceMemory - True to measure the peak memory of the search with
+     tracemalloc (slower), False to read only the peak resident memory of
+     the process
+    '''
+    def __init__(self, traceMemory=False):
+        self.traceMemory = traceMemory
+        self.reset()
+
+    # clears the collected values
+    def reset(self):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.times['total'] = 0.0
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.peak_memory = None
+        self.process_peak_memory = None
+
+    # measures the wall time of a stage
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    # adds to a candidate counter
+    def count(self, name, value):
+        self.counts[name] += int(value)
+
+    # measures the whole search: total wall time, peak memory of the search
+    # when traced and peak resident memory of the process
+    @contextlib.contextmanager
+    def run(self):
+        tracing = self.traceMemory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times['total'] += time.perf_counter() - start
+            if self.traceMemory:
+                peak = tracemalloc.get_traced_memory()[1]
+                if tracing:
+                    tracemalloc.stop()
+                self.peak_memory = max(self.peak_memory or 0, peak)
+            peak = peakResidentMemory()
+            if peak is not None:
+                self.process_peak_memory = max(self.process_peak_memory or 0, peak)
+
+    # adds the values collected by another SearchStats, e.g. from a worker process
+    def merge(self, other):
+        for name, value in other.times.items():
+            self.times[name] = self.times.get(name, 0.0) + value
+        for name, value in other.counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+        if other.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, other.peak_memory)
+        if other.process_peak_memory is not None:
+            self.process_peak_memory = max(self.process_peak_memory or 0, other.process_peak_memory)
+
+    # the collected values as a dictionary; peak_memory is None unless traced
+    def report(self):
+        return {'times': dict(self.times),
+                'counts': dict(self.counts),
+                'peak_memory': self.peak_memory,
+                'process_peak_memory': self.process_peak_memory}
+
+'''
+ Gets the context that measures a stage, or a no-op one without stats
+
+ stats - SearchStats or None
+ name - stage name
+'''
+def stage(stats, name):
+    if stats is None:
+        return _NULL
+    return stats.stage(name)
+
+'''
+ Gets the context that measures the whole search, or a no-op one without stats
+
+ stats - SearchStats or None
+'''
+def run(stats):
+    if stats is None:
+        return _NULL
+    return stats.run()
+
+'''
+ Gets the peak resident memory of this process in bytes, since it started,
+ or None where the resource module is not available (Windows)
+'''
+def peakResidentMemory():
+    try:
+        import resource
+        import sys
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak*1024
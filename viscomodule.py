@@ -10,18 +10,23 @@ from PyQt5.QtWidgets import *
 # from PyQt5.QtWidgets import QTableWidget,QTableWidgetItem, QTableView, QHeaderView
 
 from PyQt5.QtGui import QIntValidator, QDoubleValidator, QDesktopServices, QIcon
-from PyQt5.QtCore import pyqtSlot, QSize, Qt, QAbstractTableModel, QUrl
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, QSize, Qt, QAbstractTableModel, QUrl, QThread
  
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
-
 import prony as pr
 import numpy as np
 import pronySerie as ps
+import fitCache as fc
 
 import threading
+
+# numbers of terms of the 'todos' option
+TERMS = [7, 8, 9, 10, 11]
+
+# export file types, by their file dialog filters
+EXPORT_FILTERS = {'csv(*.csv)': '.csv', 'npy(*.npy)': '.npy', 'npz(*.npz)': '.npz'}
+
+# time grids of the test simulation, by their prony.simulationTimes names
+SIMULATION_GRIDS = {'linear': 'linear', 'logarítmica': 'log'}
  
 class App(QMainWindow):
  
@@ -61,10 +66,15 @@ class App(QMainWindow):
         self.inputTension = [[],[]]
         self.outputTension = []
 
-        # the pronySerie object
+        # the pronySerie object, its results are cached on disk
+        self.fitCache = fc.FitCache()
         self.pronySerie = ps.PronySerie()
+        self.pronySerie.setCache(self.fitCache)
         self.simulationProny = ps.PronySerie()
 
+        # the running exports (ExportThread)
+        self.exportThreads = []
+
         # the table
         self.initializeTable()
 
@@ -117,10 +127,14 @@ class App(QMainWindow):
         self.lblSpace = QLabel('Espaçamento entre tempos de relaxação:')
         self.lblSpace.setToolTip('Configura a mantissa dos valores de tempo de relaxação testados. \n' +
                                  'Quanto menor este valor, maiores serão o esforço computacional\n' +
-                                 'e a precisão da busca pelo melhor resultado')
+                                 'e a precisão da busca pelo melhor resultado.\n' +
+                                 'Contínuo: otimiza os tempos de relaxação a partir da busca com 10.\n' +
+                                 'Adaptativo: refina de 1 até 0.1 apenas em torno dos melhores resultados')
         self.lblFile = QLabel('Arquivo:')
         self.lblFileName = QLabel('...')
         self.lblFileName.setWordWrap(True)
+        self.lblSpecimen = QLabel('Corpo de prova:')
+        self.lblSpecimen.setToolTip('Colunas de tensão do arquivo, ajustadas juntas')
         self.lblRate = QLabel('Taxa de deformação:')
         
         self.lblResults = QLabel('Resultados:')
@@ -129,18 +143,25 @@ class App(QMainWindow):
         self.lblK = QLabel('Taxa de deformação com o tempo:')
         self.lblKValue = QLabel('')
         
-        self.lblVoid1 = QLabel('')
-        self.lblVoid2 = QLabel('')
         self.lblVoid3 = QLabel('')
 
         self.lblExport = QLabel('Exportar resultados da caracterização:')
         
         # combobox
         self.cbxTerms = QComboBox(self)
-        self.cbxTerms.addItems(['7','8','9','10','11'])
+        self.cbxTerms.addItems(['7','8','9','10','11','todos'])
+        self.cbxTerms.setToolTip('todos: ajusta de 7 a 11 termos em uma única busca em grade')
 
         self.cbxSpace = QComboBox(self)
-        self.cbxSpace.addItems(['10','1','0.5','0.25','0.1'])
+        self.cbxSpace.addItems(['10','1','0.5','0.25','0.1','adaptativo','contínuo'])
+
+        self.cbxSpecimen = QComboBox(self)
+        self.cbxSpecimen.setEnabled(False)
+        self.cbxSpecimen.currentIndexChanged.connect(self.changeSpecimen)
+
+        # progress of the relaxation times search
+        self.pgbProny = QProgressBar(self)
+        self.pgbProny.setValue(0)
 
         # textfields
         self.doubleValidator = QDoubleValidator()
@@ -161,13 +182,17 @@ class App(QMainWindow):
         self.btnCurve.clicked.connect(self.plotCreepCurve) # creep test curve 
         self.btnProny = QPushButton('Calcular', self)
         self.btnProny.clicked.connect(self.actionProny) # prony    
+        self.btnCancel = QPushButton('Cancelar', self)
+        self.btnCancel.clicked.connect(self.actionCancelProny) # cancel prony
+        self.btnCancel.setEnabled(False)
         self.btnFile = QPushButton('Importar')
         self.btnFile.clicked.connect(lambda: self.openFileNameDialog('prony')) # import     
         self.btnClear = QPushButton('Limpar tudo')
         self.btnClear.clicked.connect(self.actionClearProny) # clear results    
         self.btnImage = QPushButton('Gráfico')
         self.btnImage.clicked.connect(self.plotPronyCurve) # image      
-        self.btnTable = QPushButton('Arquivo csv')
+        self.btnTable = QPushButton('Arquivo de dados')
+        self.btnTable.setToolTip('csv, npy ou npz')
         self.btnTable.clicked.connect(lambda: self.actionTableExportData('csv')) # csv
         self.btnTexTable = QPushButton('Tabela tex')
         self.btnTexTable.clicked.connect(lambda: self.actionTableExportData('tex')) # tex   
@@ -195,7 +220,8 @@ class App(QMainWindow):
         self.leftLayout1.addWidget(self.lblFile, 1)
         self.leftLayout1.addWidget(self.lblFileName, 3)        
         self.leftLayout1.addWidget(self.btnFile, 1)
-        self.leftLayout2.addWidget(self.lblVoid1, 3)
+        self.leftLayout2.addWidget(self.lblSpecimen, 2)
+        self.leftLayout2.addWidget(self.cbxSpecimen, 1)
         self.leftLayout2.addWidget(self.btnCurve, 1)
         self.leftLayout3.addWidget(self.lblTerms, 5)
         self.leftLayout3.addWidget(self.cbxTerms, 1)
@@ -205,7 +231,8 @@ class App(QMainWindow):
         self.leftLayout5.addWidget(self.tfdEinf, 1)
         self.leftLayout6.addWidget(self.lblSpace, 5)
         self.leftLayout6.addWidget(self.cbxSpace, 1)
-        self.leftLayout7.addWidget(self.lblVoid2, 3)
+        self.leftLayout7.addWidget(self.pgbProny, 2)
+        self.leftLayout7.addWidget(self.btnCancel, 1)
         self.leftLayout7.addWidget(self.btnProny, 1)
         
         self.leftLayout8.addWidget(self.btnImage, 1)
@@ -292,7 +319,10 @@ class App(QMainWindow):
         self.lblTensionFile = QLabel('Arquivo:')
         self.lblTensionFileName = QLabel('...')
         self.lblTensionFileName.setWordWrap(True)      
-        self.lblTensionVoid1 = QLabel('')      
+        self.lblTensionGrid = QLabel('Escala de tempo:')
+        self.lblTensionGrid.setToolTip('Linear: leituras igualmente espaçadas.\n' +
+                                       'Logarítmica: leituras igualmente espaçadas no logaritmo do tempo,\n' +
+                                       'a partir de 6 décadas antes da duração do ensaio')
         self.lblTensionVoid2 = QLabel('')      
         self.lblTensionVoid3 = QLabel('')
 
@@ -307,6 +337,10 @@ class App(QMainWindow):
         self.tfdTensionK = QLineEdit(self)
         self.tfdTensionK.setValidator(self.doubleValidator)
 
+        # combobox
+        self.cbxTensionGrid = QComboBox()
+        self.cbxTensionGrid.addItems(list(SIMULATION_GRIDS))
+
         # button
         self.btnTensionFile = QPushButton('Importar')
         self.btnTensionFile.clicked.connect(lambda: self.openFileNameDialog('tension')) # import
@@ -314,7 +348,8 @@ class App(QMainWindow):
         self.btnTension.clicked.connect(self.actionTension) # simulate      
         self.btnTensionImage = QPushButton('Ver curva')
         self.btnTensionImage.clicked.connect(self.plotSimulationCurve) # plot    
-        self.btnTensionTable = QPushButton('Arquivo csv')
+        self.btnTensionTable = QPushButton('Arquivo de dados')
+        self.btnTensionTable.setToolTip('csv, npy ou npz')
         self.btnTensionTable.clicked.connect(self.actionSimulationExportData) # export    
         self.btnTensionClear = QPushButton('Limpar tudo')
         self.btnTensionClear.clicked.connect(self.actionClearTension) # clear
@@ -332,7 +367,8 @@ class App(QMainWindow):
         self.rightLayout5.addWidget(self.lblTensionFile, 1)
         self.rightLayout5.addWidget(self.lblTensionFileName, 5)
         self.rightLayout5.addWidget(self.btnTensionFile, 2)
-        self.rightLayout6.addWidget(self.lblTensionVoid1, 3)
+        self.rightLayout6.addWidget(self.lblTensionGrid, 2)
+        self.rightLayout6.addWidget(self.cbxTensionGrid, 1)
         self.rightLayout6.addWidget(self.btnTension, 1)
         self.rightLayout7.addWidget(self.lblTensionVoid2, 1)
         self.rightLayout7.addWidget(self.btnTensionTable, 2)
@@ -369,11 +405,26 @@ class App(QMainWindow):
             QMessageBox.about(self, 'Aviso', 'Valor da taxa de deformação não informado')
         elif self.setEinf == True and len(self.tfdEinf.text()) == 0:
             QMessageBox.about(self, 'Aviso', 'Valor do módulo de equilíbrio não informado')
+        elif self.cbxTerms.currentText() == 'todos' and self.cbxSpace.currentText() in ['adaptativo', 'contínuo']:
+            QMessageBox.about(self, 'Aviso', 'A busca de todos os termos usa o espaçamento em grade')
+        elif self.pronySerie.tensions is not None and (self.cbxTerms.currentText() == 'todos' or
+                                                       self.cbxSpace.currentText() in ['adaptativo', 'contínuo']):
+            QMessageBox.about(self, 'Aviso', 'Com vários corpos de prova, escolha o número de termos e o espaçamento em grade')
         else:
 
-            self.pronySerie.setTerms(int(self.cbxTerms.currentText()))
+            if self.cbxTerms.currentText() == 'todos':
+                self.pronySerie.setTermsSweep(TERMS)
+            else:
+                self.pronySerie.setTermsSweep(None)
+                self.pronySerie.setTerms(int(self.cbxTerms.currentText()))
             self.pronySerie.setRate(float(self.tfdRate.text()))
-            self.pronySerie.setStep(float(self.cbxSpace.currentText()))
+            if self.cbxSpace.currentText() == 'contínuo':
+                self.pronySerie.setSearch('continuous')
+            elif self.cbxSpace.currentText() == 'adaptativo':
+                self.pronySerie.setSearch('adaptive')
+            else:
+                self.pronySerie.setSearch('grid')
+                self.pronySerie.setStep(float(self.cbxSpace.currentText()))
 
             if self.setEinf == True:
                 self.pronySerie.setGivenEinfSerieType(True)
@@ -381,23 +432,127 @@ class App(QMainWindow):
             else:
                 self.pronySerie.setGivenEinfSerieType(False)
 
-            try:
-                QMessageBox.about(self, 'Aviso', 'Esta operação poderá demorar alguns minutos.\n' +
-                                  'Pressione ''OK'' para prosseguir')
-                self.pronySerie.runRelaxation()
-            except UnboundLocalError:
-                QMessageBox.about(self, 'Erro', 'Não foi possível encontrar um resultado com parâmetros informados')
-            except:
-                QMessageBox.about(self, 'Erro', 'Um erro ocorreu: pronySerie.runRelaxation')            
-            else:
-                try:
-                    self.pronySerie.runPronySerie()
-                    self.updateTable()
+            # runs the search in a background thread
+            self.relaxationThread = RelaxationThread(self.pronySerie, self)
+            self.relaxationThread.progress.connect(self.updateProgress)
+            self.relaxationThread.improved.connect(self.updateBestResult)
+            self.relaxationThread.succeeded.connect(self.finishProny)
+            self.relaxationThread.failed.connect(self.failProny)
+            self.relaxationThread.cancelled.connect(self.cancelledProny)
+
+            self.pgbProny.setValue(0)
+            self.setRunningProny(True)
+            self.relaxationThread.start()
+
+    '''
+     Stops the running relaxation times search
+    '''
+    def actionCancelProny(self):
+        self.btnCancel.setEnabled(False)
+        self.relaxationThread.cancel()
+
+    '''
+     Enables the inputs of the search, or the cancel button while it runs
+    '''
+    def setRunningProny(self, bo):
+        self.btnProny.setEnabled(not bo)
+        self.btnFile.setEnabled(not bo)
+        self.cbxSpecimen.setEnabled(not bo and self.pronySerie.tensions is not None)
+        self.btnCancel.setEnabled(bo)
+        if bo:
+            self.setEnabledLeftButtons(False)
+
+    '''
+     Updates the progress bar from the number of candidates evaluated
+    '''
+    def updateProgress(self, evaluated, total):
+        self.pgbProny.setMaximum(total)
+        self.pgbProny.setValue(evaluated)
+
+    '''
+     Shows the best result found so far while the search runs
+    '''
+    def updateBestResult(self, results):
+        self.updateTable(results)
+        self.lblEinfValue.setText(str("{:.2E}".format(results.equilibrium_module)))
+
+    '''
+     Shows the result of the search once it is finished
+    '''
+    def finishProny(self):
+        self.setRunningProny(False)
+        if self.pronySerie.sweep is not None:
+            self.chooseTerms()
+        self.showResults()
+
+    '''
+     Shows the result of the search, of the selected specimen
+    '''
+    def showResults(self):
+        if self.pronySerie.results is None:
+            self.table.setRowCount(0)
+            self.lblEinfValue.setText('')
+            self.setEnabledLeftButtons(False)
+            QMessageBox.about(self, 'Aviso', 'Não foi possível encontrar um resultado para este corpo de prova')
+            return
+
+        try:
+            self.pronySerie.runPronySerie()
+            self.updateTable()
+
+            self.lblEinfValue.setText(str("{:.2E}".format(self.pronySerie.results.equilibrium_module)))
+            self.setEnabledLeftButtons(True)
+        except:
+            QMessageBox.about(self, 'Erro', 'Um erro ocorreu: pronySerie.runPronySerie')
 
-                    self.lblEinfValue.setText(str("{:.2E}".format(self.pronySerie.results.equilibrium_module)))
-                    self.setEnabledLeftButtons(True)
-                except:
-                    QMessageBox.about(self, 'Erro', 'Um erro ocorreu: pronySerie.runPronySerie')
+    '''
+     Shows the residual of each number of terms of a sweep and takes the
+     chosen one, the smallest residual by default
+    '''
+    def chooseTerms(self):
+        fits = [f for f in self.pronySerie.termsFits if f.result is not None]
+        items = ['{} termos: resíduo {:.3E}'.format(f.terms, f.residual) for f in fits]
+        current = [f.terms for f in fits].index(self.pronySerie.num)
+
+        item, ok = QInputDialog.getItem(self, 'Número de termos', 'Resíduo de cada número de termos:',
+                                        items, current, False)
+        if ok:
+            self.pronySerie.selectTerms(fits[items.index(item)].terms)
+
+    '''
+     Fills the specimens selector from the tension columns of the test
+    '''
+    def updateSpecimens(self):
+        tensions = self.pronySerie.tensions
+        self.cbxSpecimen.blockSignals(True)
+        self.cbxSpecimen.clear()
+        if tensions is not None:
+            self.cbxSpecimen.addItems([str(j+1) for j in range(len(tensions))])
+        self.cbxSpecimen.blockSignals(False)
+        self.cbxSpecimen.setEnabled(tensions is not None)
+
+    '''
+     Shows the tension and the result of the selected specimen
+    '''
+    def changeSpecimen(self, index):
+        if index < 0 or self.pronySerie.tensions is None:
+            return
+
+        self.pronySerie.selectSpecimen(index)
+        if self.pronySerie.specimenResults is not None:
+            self.showResults()
+
+    def failProny(self, message):
+        self.setRunningProny(False)
+        self.table.setRowCount(0)
+        self.lblEinfValue.setText('')
+        QMessageBox.about(self, 'Erro', message)
+
+    def cancelledProny(self):
+        self.setRunningProny(False)
+        self.table.setRowCount(0)
+        self.lblEinfValue.setText('')
+        self.pgbProny.setValue(0)
 
     '''
      Checks if the input is correct and then do the tension algoritm to get the
@@ -413,12 +568,18 @@ class App(QMainWindow):
             QMessageBox.about(self, "Aviso", "Preencha todos os campos")        
         else:
 
-            self.simulationProny.setTime(np.linspace(0, int(self.tfdTensionTime.text()), int(self.tfdTensionRate.text())))
+            self.simulationProny.setSimulationGrid(SIMULATION_GRIDS[self.cbxTensionGrid.currentText()],
+                                                   int(self.tfdTensionTime.text()),
+                                                   int(self.tfdTensionRate.text()))
             self.simulationProny.setRate(float(self.tfdTensionK.text()))
             self.simulationProny.setGivenEinf(float(self.tfdTensionEinf.text()))
             self.simulationProny.setTerms(len(self.simulationProny.modules))
 
-            self.simulationProny.runSimulation()
+            try:
+                self.simulationProny.runSimulation()
+            except ValueError as e:
+                QMessageBox.about(self, 'Erro', 'Simulação inválida: ' + str(e))
+                return
 
             # enable results option buttons
             self.setEnabledRightButtons(True)
@@ -430,22 +591,18 @@ class App(QMainWindow):
 
         # organizes the time x tension output matrix
         o1 = np.asarray([self.pronySerie.results.modules, self.pronySerie.results.relaxation_times])
-        print('o1:', o1)
-        output = o1.transpose()
-        print('output:', output)
 
         if fxt == 'csv':        
-            self.saveCSVFileDialog(output)
+            self.saveDataFileDialog(['modules', 'relaxation_times'], list(o1), self.btnTable)
         elif fxt == 'tex':
             print('tex')
             self.saveTEXTableFileDialog(o1, self.pronySerie.results.equilibrium_module, self.pronySerie.kk)
 
     def actionSimulationExportData(self):
-        # organizes the time x tension output matrix
-        o1 = np.asarray([self.simulationProny.time, self.simulationProny.tension])
-        output = o1.transpose()
-        
-        self.saveCSVFileDialog(output)        
+        # the time and tension columns
+        self.saveDataFileDialog(['time', 'tension'],
+                                [self.simulationProny.time, self.simulationProny.tension],
+                                self.btnTensionTable)
 
     '''
      Shows file selector and deals with the selected file
@@ -460,16 +617,25 @@ class App(QMainWindow):
             fileName = filePath.split("/")
 
             if typeInput == 'prony':
-                # imports the csv and puts into a prony list
-                self.pronySerie.setTestOutput(pr.readCSV(filePath))
+                # imports the csv and puts into the prony arrays
+                try:
+                    self.pronySerie.setTestOutput(pr.readCSVSpecimens(filePath))
+                except ValueError as e:
+                    QMessageBox.about(self, 'Erro', 'Arquivo inválido: ' + str(e))
+                    return
+                self.updateSpecimens()
                 
                 # updates the path to file label
                 self.lblFileName.setText(fileName[len(fileName)-1])
                 self.lblFileName.setToolTip(filePath)
 
             elif typeInput == 'tension':
-                # imports the csv and puts into a prony list
-                self.simulationProny.setSimulationInput(pr.readCSV(filePath))
+                # imports the csv and puts into the prony arrays
+                try:
+                    self.simulationProny.setSimulationInput(pr.readCSV(filePath))
+                except ValueError as e:
+                    QMessageBox.about(self, 'Erro', 'Arquivo inválido: ' + str(e))
+                    return
                 
                 # updates the path to file label
                 self.lblTensionFileName.setText(fileName[len(fileName)-1])
@@ -478,13 +644,25 @@ class App(QMainWindow):
     '''
      Shows dialog "Save as csv file" to save the result from simulation or from table
     '''
-    def saveCSVFileDialog(self, output):    
+    def saveDataFileDialog(self, names, columns, button):
         options = QFileDialog.Options()
         options |= QFileDialog.DontUseNativeDialog
-        fileName, _ = QFileDialog.getSaveFileName(self,'Salvar resultado como arquivo CSV','','csv(*.csv)', options=options)
+        fileName, selected = QFileDialog.getSaveFileName(self,'Salvar resultado como arquivo de dados','',
+                                                         ';;'.join(EXPORT_FILTERS), options=options)
         if fileName:
+            ext = EXPORT_FILTERS.get(selected, '.csv')
+            if not fileName.lower().endswith(ext):
+                fileName += ext
             print(fileName)
-            np.savetxt(fileName + '.csv', output, delimiter = ',')
+
+            # written in a background thread, the button is enabled again at the end
+            button.setEnabled(False)
+            thread = ExportThread(fileName, names, columns, self)
+            thread.failed.connect(lambda message: QMessageBox.about(self, 'Erro', message))
+            thread.finished.connect(lambda: button.setEnabled(True))
+            thread.finished.connect(lambda: self.exportThreads.remove(thread))
+            self.exportThreads.append(thread)
+            thread.start()
 
     '''
      Shows dialog "Save as tex file" to save the result from simulation or from table in a tex table
@@ -540,6 +718,8 @@ class App(QMainWindow):
             self.tfdEinf.setText('')
             self.table.setRowCount(0)
             self.pronySerie = ps.PronySerie()
+            self.pronySerie.setCache(self.fitCache)
+            self.updateSpecimens()
             self.setEnabledLeftButtons(False)
 
     def actionClearTension(self):
@@ -603,17 +783,21 @@ class App(QMainWindow):
     '''
      Set the result data in to the table
     '''
-    def updateTable(self):
-        self.table.setRowCount(self.pronySerie.num)
+    def updateTable(self, results=None):
+        if results is None:
+            results = self.pronySerie.results
+
+        num = len(results.relaxation_times)
+        self.table.setRowCount(num)
         i=0
-        while i < self.pronySerie.num:
+        while i < num:
             
-            itemTime = QTableWidgetItem(str("{:.2E}".format(abs(self.pronySerie.results.relaxation_times[i]))))
+            itemTime = QTableWidgetItem(str("{:.2E}".format(abs(results.relaxation_times[i]))))
             itemTime.setTextAlignment(Qt.AlignCenter)
             itemTime.setFlags(Qt.ItemIsEnabled)
             self.table.setItem(i,0,itemTime)
 
-            itemModule = QTableWidgetItem(str("{:.2E}".format(self.pronySerie.results.modules[i])))
+            itemModule = QTableWidgetItem(str("{:.2E}".format(results.modules[i])))
             itemModule.setTextAlignment(Qt.AlignCenter)
             itemModule.setFlags(Qt.ItemIsEnabled)
             self.table.setItem(i,1,itemModule)
@@ -659,12 +843,82 @@ class App(QMainWindow):
     def openUrl(self, url):
         QDesktopServices.openUrl(QUrl(url))
 
+'''
+ This class runs the relaxation times search of a PronySerie in a background
+ thread, reporting the progress and each better result found so far.
+ The search stops at the next block of candidates after cancel()
+'''
+class RelaxationThread(QThread):
+    progress = pyqtSignal(int, int)
+    improved = pyqtSignal(object)
+    succeeded = pyqtSignal()
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, pronySerie, parent=None):
+        super(RelaxationThread, self).__init__(parent)
+        self.pronySerie = pronySerie
+        self.cancelEvent = threading.Event()
+        self.best = None
+
+    def run(self):
+        try:
+            self.pronySerie.runRelaxation(self.report, self.cancelEvent)
+        except pr.SearchCancelled:
+            self.cancelled.emit()
+        except ValueError:
+            self.failed.emit('Não foi possível encontrar um resultado com parâmetros informados')
+        except:
+            self.failed.emit('Um erro ocorreu: pronySerie.runRelaxation')
+        else:
+            self.succeeded.emit()
+
+    # called by the search, in this thread, after each block of candidates
+    def report(self, evaluated, total, best):
+        self.progress.emit(evaluated, total)
+        if best is not None and (self.best is None or
+                                 not np.array_equal(best.relaxation_times, self.best.relaxation_times) or
+                                 not np.array_equal(best.modules, self.best.modules)):
+            self.best = best
+            self.improved.emit(best)
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+'''
+ This class writes columns of values to a file in a background thread
+ (prony.writeColumns), so a large export does not block the interface
+'''
+class ExportThread(QThread):
+    failed = pyqtSignal(str)
+
+    def __init__(self, fileName, names, columns, parent=None):
+        super(ExportThread, self).__init__(parent)
+        self.fileName = fileName
+        self.names = names
+        self.columns = columns
+
+    def run(self):
+        try:
+            pr.writeColumns(self.fileName, self.names, self.columns)
+        except OSError as e:
+            self.failed.emit('Não foi possível salvar o arquivo: ' + str(e))
+
 '''
  This class show a Dialog with a plot
 '''
 class PlotWindow(QDialog):
+    # points of a curve drawn as they are, larger curves are decimated
+    # (prony.decimationIndex) to the canvas width in the visible range,
+    # again after each zoom, pan or resize
     def __init__(self, xx, yy, xlabel, ylabel, parent=None):
         super(PlotWindow, self).__init__(parent)
+
+        # matplotlib and its Qt backend are loaded when the first plot is opened
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+        from matplotlib.figure import Figure
+        import matplotlib.pyplot as plt
         
         plt.style.use('seaborn-paper')
         plt.rcParams['font.sans-serif'] = "DejaVu Sans"
@@ -686,7 +940,13 @@ class PlotWindow(QDialog):
         ax = self.figure.add_subplot(111) # create an axis
         ax.clear() # discards the old graph
         color = 'orangered'
-        ax.plot(xx, yy, color=color)
+        self.ax = ax
+        self.xx = np.asarray(xx, dtype=float)
+        self.yy = np.asarray(yy, dtype=float)
+        idx = self.viewIndex(self.xx[0], self.xx[-1]) if len(self.xx) > 0 else []
+        self.line, = ax.plot(self.xx[idx], self.yy[idx], color=color)
+        ax.callbacks.connect('xlim_changed', lambda ax: self.updateView())
+        self.canvas.mpl_connect('resize_event', lambda event: self.updateView())
         ax.set_xlabel(xlabel, fontsize=11)
         ax.set_ylabel(ylabel, fontsize=11)
         ax.tick_params(axis='both', which='major', labelsize=10)
@@ -700,6 +960,25 @@ class PlotWindow(QDialog):
         layout.addWidget(self.toolbar)
         layout.addWidget(self.canvas)
         self.setLayout(layout)
+
+    '''
+     Gets the positions of the points drawn in an x range, at least two per
+     pixel column of the axis
+    '''
+    def viewIndex(self, lo, hi):
+        bins = max(int(self.ax.bbox.width), 1)
+        return pr.decimationIndex(self.xx, self.yy, lo, hi, bins)
+
+    '''
+     Draws the points of the visible x range again
+    '''
+    def updateView(self):
+        if len(self.xx) == 0:
+            return
+        lo, hi = sorted(self.ax.get_xlim())
+        idx = self.viewIndex(lo, hi)
+        self.line.set_data(self.xx[idx], self.yy[idx])
+        self.canvas.draw_idle()
                 
 if __name__ == '__main__':
     app = QApplication(sys.argv)